@@ -0,0 +1,230 @@
+import datetime
+import heapq
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import func
+
+from app import flask_app, db
+from app.models import Order, OrderItem, Product
+
+#In-process best sellers by units sold: overall, per category and over the last 24 hours
+#(hourly summaries of order_date, merged on read). Each is a Space-Saving summary of
+#BEST_SELLERS_CAPACITY counters, so memory is bounded and a product's count is over-estimated
+#by at most its reported error. The order item routes feed it after commit. It is loaded
+#from an exact aggregation on first use and reconciled against the database in the
+#background every BEST_SELLERS_RECONCILE_SECONDS, which also picks up other processes' writes
+#and the drift of decrements (Space-Saving only handles those approximately).
+
+WINDOW_HOURS = 24
+SCOPES = ('overall', 'category', '24h')
+
+class SpaceSaving:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.heap = []
+        self.ranked = None
+
+    def load(self, counts):
+        for key, count in heapq.nlargest(self.capacity, counts.items(), key=lambda item: item[1]):
+            self.counts[key] = [count, 0]
+        self.heap = [(entry[0], key) for key, entry in self.counts.items()]
+        heapq.heapify(self.heap)
+        self.ranked = None
+
+    def add(self, key, amount):
+        if amount < 0:
+            return self.subtract(key, -amount)
+        if not amount:
+            return
+        entry = self.counts.get(key)
+        if entry is None:
+            floor = self.evict() if len(self.counts) >= self.capacity else 0
+            entry = self.counts[key] = [floor, floor]
+        entry[0] += amount
+        self.push(key, entry[0])
+
+    def subtract(self, key, amount):
+        entry = self.counts.get(key)
+        if entry is None:
+            return
+        entry[0] = max(entry[0] - amount, 0)
+        entry[1] = min(entry[1], entry[0])
+        self.push(key, entry[0])
+
+    #the heap holds (count, key) for every count a key has had; stale entries are skipped
+    #when evicting and dropped when the heap grows past a few times the capacity
+
+    def push(self, key, count):
+        self.ranked = None
+        heapq.heappush(self.heap, (count, key))
+        if len(self.heap) > 4 * self.capacity + 64:
+            self.heap = [(entry[0], key) for key, entry in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def evict(self):
+        while True:
+            count, key = heapq.heappop(self.heap)
+            entry = self.counts.get(key)
+            if entry is not None and entry[0] == count:
+                del self.counts[key]
+                return count
+
+    def top(self, limit):
+        if self.ranked is None:
+            self.ranked = sorted(((key, entry[0], entry[1]) for key, entry in self.counts.items() if entry[0] > 0),
+                                 key=lambda item: (-item[1], item[0]))
+        return self.ranked[:limit]
+
+def hour_of(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+class BestSellers:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reconciling = False
+        self.loaded_at = None
+        self.reset()
+
+    def reset(self):
+        self.overall = SpaceSaving(self.capacity())
+        self.categories = {}
+        self.hours = {}
+        self.window = None
+
+    def capacity(self):
+        return flask_app.config.get('BEST_SELLERS_CAPACITY', 1000)
+
+    def category(self, category_id):
+        summary = self.categories.get(category_id)
+        if summary is None:
+            summary = self.categories[category_id] = SpaceSaving(self.capacity())
+        return summary
+
+    def hour(self, hour):
+        summary = self.hours.get(hour)
+        if summary is None:
+            summary = self.hours[hour] = SpaceSaving(self.capacity())
+        return summary
+
+    def add(self, product_id, category_id, order_date, units):
+        with self.lock:
+            self.overall.add(product_id, units)
+            self.category(category_id).add(product_id, units)
+            if order_date >= hour_of(datetime.datetime.now()) - datetime.timedelta(hours=WINDOW_HOURS - 1):
+                self.hour(hour_of(order_date)).add(product_id, units)
+                self.window = None
+
+    #changes are (before, after) snapshots of (order_id, product_id, quantity, ...), as recorded
+    #for the sales rollups; called after commit
+
+    def record_changes(self, changes):
+        if self.loaded_at is None:
+            return
+        units = defaultdict(int)
+        for before, after in changes:
+            if before is not None:
+                units[(before[0], before[1])] -= before[2]
+            if after is not None:
+                units[(after[0], after[1])] += after[2]
+        units = {key: value for key, value in units.items() if value}
+        if not units:
+            return
+        categories = dict(db.session.query(Product.id, Product.category_id)
+                          .filter(Product.id.in_({product_id for _, product_id in units})))
+        dates = dict(db.session.query(Order.id, Order.order_date)
+                     .filter(Order.id.in_({order_id for order_id, _ in units})))
+        for (order_id, product_id), value in units.items():
+            if product_id in categories and order_id in dates:
+                self.add(product_id, categories[product_id], dates[order_id], value)
+
+    #exact aggregation from the database into fresh summaries, swapped in at the end
+
+    def reconcile(self):
+        fresh = BestSellers()
+        overall = {}
+        per_category = defaultdict(dict)
+        rows = db.session.execute(
+            db.select(OrderItem.product_id, Product.category_id, func.sum(OrderItem.quantity))
+            .join(Product, OrderItem.product_id == Product.id)
+            .group_by(OrderItem.product_id, Product.category_id)
+            .execution_options(yield_per=5000))
+        for product_id, category_id, units in rows:
+            overall[product_id] = overall.get(product_id, 0) + int(units)
+            per_category[category_id][product_id] = int(units)
+        fresh.overall.load(overall)
+        for category_id, counts in per_category.items():
+            fresh.category(category_id).load(counts)
+
+        since = hour_of(datetime.datetime.now()) - datetime.timedelta(hours=WINDOW_HOURS - 1)
+        hourly = defaultdict(lambda: defaultdict(int))
+        rows = db.session.query(OrderItem.product_id, Order.order_date, OrderItem.quantity)\
+            .join(Order, OrderItem.order_id == Order.id)\
+            .filter(Order.order_date >= since)
+        for product_id, order_date, quantity in rows:
+            hourly[hour_of(order_date)][product_id] += quantity
+        for hour, counts in hourly.items():
+            fresh.hour(hour).load(counts)
+
+        with self.lock:
+            self.overall, self.categories, self.hours, self.window = fresh.overall, fresh.categories, fresh.hours, None
+            self.loaded_at = time.monotonic()
+
+    def reconcile_in_background(self):
+        with self.lock:
+            if self.reconciling:
+                return
+            self.reconciling = True
+
+        def run():
+            try:
+                with flask_app.app_context():
+                    self.reconcile()
+            finally:
+                self.reconciling = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def ensure_fresh(self):
+        if self.loaded_at is None:
+            with self.lock:
+                if self.loaded_at is None:
+                    self.reconcile()
+            return
+        if time.monotonic() - self.loaded_at >= flask_app.config.get('BEST_SELLERS_RECONCILE_SECONDS', 300):
+            self.reconcile_in_background()
+
+    #merges the hourly summaries still inside the window; cached until the next write or hour
+
+    def last_day(self, limit):
+        now = hour_of(datetime.datetime.now())
+        with self.lock:
+            if self.window is None or self.window[0] != now:
+                since = now - datetime.timedelta(hours=WINDOW_HOURS - 1)
+                for hour in [hour for hour in self.hours if hour < since]:
+                    del self.hours[hour]
+                merged = defaultdict(lambda: [0, 0])
+                for summary in self.hours.values():
+                    for key, entry in summary.counts.items():
+                        merged[key][0] += entry[0]
+                        merged[key][1] += entry[1]
+                ranked = sorted(((key, count, error) for key, (count, error) in merged.items() if count > 0),
+                                key=lambda item: (-item[1], item[0]))
+                self.window = (now, ranked[:self.capacity()])
+            return self.window[1][:limit]
+
+    #returns [(product_id, units, error)], best first
+
+    def top(self, scope='overall', limit=50, category_id=None):
+        self.ensure_fresh()
+        if scope == '24h':
+            return self.last_day(limit)
+        with self.lock:
+            if scope == 'category':
+                summary = self.categories.get(category_id)
+                return summary.top(limit) if summary is not None else []
+            return self.overall.top(limit)
+
+best_sellers = BestSellers()
@@ -0,0 +1,191 @@
+import json
+from decimal import Decimal, InvalidOperation
+
+from flask import request
+from sqlalchemy import Integer, Numeric, String, Text, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import flask_app, db
+from app.pagination import bad_request, int_arg
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonlines')
+MAX_CHUNK_SIZE = 10000
+
+#Bulk writes accept a JSON array or an NDJSON body, validate each item against the
+#model's columns and write valid items chunk by chunk (one executemany and one commit
+#per chunk). A chunk the database rejects is rolled back and reported as failed;
+#the other chunks are kept.
+
+def chunk_size():
+    default = flask_app.config.get('BULK_CHUNK_SIZE', 500)
+    return min(int_arg('chunk_size', default, minimum=1), MAX_CHUNK_SIZE)
+
+def parse_items():
+    if request.mimetype in NDJSON_MIMETYPES:
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+        return
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        bad_request('expected a JSON array or an NDJSON body')
+    yield from items
+
+def check_type(column, value):
+    if value is None:
+        return True
+    if isinstance(column.type, Integer):
+        return isinstance(value, int) and not isinstance(value, bool)
+    if isinstance(column.type, Numeric):
+        if isinstance(value, bool):
+            return False
+        try:
+            Decimal(str(value))
+        except InvalidOperation:
+            return False
+        return True
+    if isinstance(column.type, (String, Text)):
+        return isinstance(value, str)
+    return True
+
+def validate(model, item, partial=False):
+    if not isinstance(item, dict):
+        return 'item must be a JSON object'
+    columns = model.__table__.columns
+    unknown = sorted(set(item) - set(columns.keys()))
+    if unknown:
+        return 'unknown fields: %s' % ', '.join(unknown)
+    for column in columns:
+        if column.nullable or column.primary_key or column.default is not None:
+            continue
+        if item.get(column.name) is None and (not partial or column.name in item):
+            return 'missing field: %s' % column.name
+    for column in columns:
+        if column.name in item and not check_type(column, item[column.name]):
+            return 'invalid value for field: %s' % column.name
+    return None
+
+#MySQL has no RETURNING. A multi-row INSERT there gets consecutive auto-increment ids from
+#lastrowid on, unless innodb_autoinc_lock_mode is 2 (interleaved, the MySQL 8 default), which
+#may interleave them with concurrent inserts. The mode is read once per connection.
+
+def consecutive_autoincrement(connection):
+    if connection.dialect.name != 'mysql':
+        return False
+    if 'autoinc_lock_mode' not in connection.info:
+        connection.info['autoinc_lock_mode'] = int(
+            connection.exec_driver_sql('SELECT @@innodb_autoinc_lock_mode').scalar())
+    return connection.info['autoinc_lock_mode'] in (0, 1)
+
+def matching_value(column):
+    if isinstance(column.type, Numeric):
+        scale = column.type.scale if column.type.scale is not None else 10
+        return lambda value: None if value is None else round(float(value), scale)
+    return lambda value: value
+
+#pairs the inserted rows with (id, *column values) rows read back in no particular order.
+#Rows with the same values are interchangeable, so each takes the lowest id left for its
+#values; a row whose values came back changed (e.g. rounded differently by the database)
+#takes the lowest id nobody matched.
+
+def match_ids(columns, rows, returned):
+    normalize = [matching_value(column) for column in columns]
+    ids = {}
+    for row in sorted(returned, key=lambda row: row[0]):
+        ids.setdefault(tuple(convert(value) for convert, value in zip(normalize, row[1:])), []).append(row[0])
+    matched = [None] * len(rows)
+    for index, row in enumerate(rows):
+        candidates = ids.get(tuple(convert(row[column.name]) for convert, column in zip(normalize, columns)))
+        if candidates:
+            matched[index] = candidates.pop(0)
+    unmatched = iter(sorted(id for candidates in ids.values() for id in candidates))
+    return [id if id is not None else next(unmatched, None) for id in matched]
+
+#inserts rows and returns their ids in order, with one multi-row INSERT when the rows set the
+#same columns: the ids come from RETURNING where the dialect has it; on MySQL from lastrowid
+#on where they are consecutive, and otherwise from one SELECT of the rows from lastrowid on,
+#matched back to the inserted rows by their values. RETURNING ... sort_by_parameter_order would be
+#simpler, but without a sentinel column SQLAlchemy sends it one row per statement.
+
+def insert_rows(model, rows):
+    if not rows:
+        return []
+    if all(row.get('id') is not None for row in rows):
+        db.session.execute(insert(model), rows)
+        return [row['id'] for row in rows]
+    connection = db.session.connection()
+    names = set(rows[0])
+    if 'id' in names or any(set(row) != names for row in rows):
+        return [db.session.execute(insert(model).values(row)).inserted_primary_key[0] for row in rows]
+    columns = [model.__table__.c[name] for name in sorted(names)]
+    if connection.dialect.insert_returning:
+        returned = db.session.execute(insert(model).returning(model.id, *columns), rows).all()
+        return match_ids(columns, rows, returned)
+    if connection.dialect.name != 'mysql':
+        return [db.session.execute(insert(model).values(row)).inserted_primary_key[0] for row in rows]
+    first = db.session.execute(insert(model).values(rows)).lastrowid
+    if consecutive_autoincrement(connection):
+        return list(range(first, first + len(rows)))
+    returned = db.session.execute(select(model.id, *columns).where(model.id >= first)).all()
+    return match_ids(columns, rows, returned)
+
+def update_rows(model, rows):
+    db.session.execute(update(model), rows)
+
+def created(index, id):
+    return {'index': index, 'status': 'created', 'id': id}
+
+def updated(index, id):
+    return {'index': index, 'status': 'updated', 'id': id}
+
+def failed(index, error):
+    return {'index': index, 'status': 'error', 'error': error}
+
+#default chunk writer: plain inserts
+
+def create_chunk(model):
+    def write(chunk):
+        ids = insert_rows(model, [item for _, item in chunk])
+        return [created(index, id) for (index, _), id in zip(chunk, ids)]
+    return write
+
+def run_bulk(model, write_chunk, partial=False, after_commit=None):
+    size = chunk_size()
+    results = []
+    chunk = []
+
+    def flush(chunk):
+        try:
+            chunk_results = write_chunk(chunk)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            message = str(getattr(e, 'orig', None) or e)
+            return [failed(index, message) for index, _ in chunk]
+        if after_commit:
+            after_commit(chunk_results)
+        return chunk_results
+
+    for index, item in enumerate(parse_items()):
+        error = validate(model, item, partial)
+        if error:
+            results.append(failed(index, error))
+            continue
+        chunk.append((index, item))
+        if len(chunk) == size:
+            results.extend(flush(chunk))
+            chunk = []
+    if chunk:
+        results.extend(flush(chunk))
+
+    results.sort(key=lambda result: result['index'])
+    summary = {'created': 0, 'updated': 0, 'error': 0}
+    for result in results:
+        summary[result['status']] += 1
+    return {'created': summary['created'], 'updated': summary['updated'],
+            'failed': summary['error'], 'results': results}
@@ -0,0 +1,165 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from app import flask_app
+
+MISSING = object()
+
+#interface every cache backend implements; values must be JSON-serializable so
+#that out-of-process backends can store them
+
+class CacheBackend:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        raise NotImplementedError
+
+    def incr(self, key):
+        raise NotImplementedError
+
+    def counter(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+#in-process LRU with per-entry expiry; counters live outside the LRU so they are never evicted
+
+class LRUCache(CacheBackend):
+    def __init__(self, max_entries=10000, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def incr(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+    def counter(self, key):
+        return self.counters.get(key, 0)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.counters.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+#backend for any Redis-compatible client exposing get/set(ex=)/delete/incr
+
+class RedisCache(CacheBackend):
+    def __init__(self, client, ttl=None, prefix='ecommerce:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return MISSING if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl or None)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def incr(self, key):
+        return int(self.client.incr(self.prefix + 'counter:' + key))
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + 'counter:' + key) or 0)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+#read-through cache with hit/miss counters per key namespace (the part of the key before ':').
+#Single rows are invalidated by key; list pages carry a namespace generation in their key
+#and are all dropped at once by bumping it.
+
+class ReadThroughCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+
+    def count(self, counters, key):
+        namespace = key.split(':', 1)[0]
+        with self.lock:
+            counters[namespace] = counters.get(namespace, 0) + 1
+
+    def get_or_load(self, key, loader, ttl=None):
+        value = self.backend.get(key)
+        if value is not MISSING:
+            self.count(self.hits, key)
+            return value
+        self.count(self.misses, key)
+        value = loader()
+        if value is not None:
+            self.backend.set(key, value, ttl)
+        return value
+
+    def invalidate(self, *keys):
+        self.backend.delete(*keys)
+
+    def generation(self, namespace):
+        return self.backend.counter('generation:' + namespace)
+
+    def bump(self, *namespaces):
+        for namespace in namespaces:
+            self.backend.incr('generation:' + namespace)
+
+    def page_key(self, namespace, *parts):
+        return ':'.join([namespace, str(self.generation(namespace))] + [str(part) for part in parts])
+
+    def stats(self):
+        namespaces = sorted(set(self.hits) | set(self.misses))
+        result = {}
+        for namespace in namespaces:
+            hits = self.hits.get(namespace, 0)
+            misses = self.misses.get(namespace, 0)
+            result[namespace] = {'hits': hits, 'misses': misses,
+                                 'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+        return result
+
+cache = ReadThroughCache(LRUCache(max_entries=flask_app.config.get('CACHE_MAX_ENTRIES', 10000),
+                                  ttl=flask_app.config.get('CACHE_TTL', 300)))
@@ -0,0 +1,40 @@
+from decimal import Decimal
+
+from sqlalchemy import delete, func, insert, select
+
+from app.counters import add_to_rows
+from app.models import CategoryStats, Product
+
+#category_stats holds product count, price sum and stock total per category.
+#Product writes record their before/after snapshot in the same session, so the
+#stats row is committed (or rolled back) together with the product itself.
+
+def snapshot_of(category_id, price, quantity):
+    return (int(category_id), Decimal(str(price)), int(quantity))
+
+def snapshot(product):
+    return snapshot_of(product.category_id, product.price, product.quantity)
+
+def record_product_changes(changes):
+    deltas = {}
+    for before, after in changes:
+        if before is not None:
+            category_id, price, quantity = before
+            count, price_sum, stock = deltas.get(category_id, (0, 0, 0))
+            deltas[category_id] = (count - 1, price_sum - price, stock - quantity)
+        if after is not None:
+            category_id, price, quantity = after
+            count, price_sum, stock = deltas.get(category_id, (0, 0, 0))
+            deltas[category_id] = (count + 1, price_sum + price, stock + quantity)
+    add_to_rows(CategoryStats, ('category_id',), ('product_count', 'price_sum', 'stock_total'),
+                {(category_id,): delta for category_id, delta in deltas.items()})
+
+def record_product_change(before=None, after=None):
+    record_product_changes([(before, after)])
+
+def rebuild_category_stats(connection):
+    connection.execute(delete(CategoryStats))
+    connection.execute(insert(CategoryStats).from_select(
+        ['category_id', 'product_count', 'price_sum', 'stock_total'],
+        select(Product.category_id, func.count(Product.id), func.sum(Product.price), func.sum(Product.quantity))
+        .group_by(Product.category_id)))
@@ -0,0 +1,145 @@
+import datetime
+
+import click
+
+from app import flask_app, db
+from app.category_stats import rebuild_category_stats
+from app.explain import explain_routes
+from app.export import export, check_format, format_watermark, FORMATS, WATERMARKS
+from app.migrations import migrate, pending_migrations
+from app.recommendations import recommendations
+from app.sales_rollups import rebuild_sales_rollups
+from app.order_totals import backfill_order_totals, check_order_totals
+from app.inventory import expire_reservations, invalidate_products, shard_product, sync_sharded_stock, unshard_product
+
+@flask_app.cli.command('init-db')
+def init_db():
+    """Create any missing tables (existing tables are left untouched)."""
+    db.create_all()
+    click.echo('Tables created')
+
+@flask_app.cli.command('rebuild-category-stats')
+def rebuild_category_stats_command():
+    """Recompute the category_stats table from products."""
+    rebuild_category_stats(db.session.connection())
+    db.session.commit()
+    click.echo('Category stats rebuilt')
+
+@flask_app.cli.command('expire-reservations')
+def expire_reservations_command():
+    """Release pending reservations whose TTL has passed."""
+    released = expire_reservations()
+    click.echo('%d reservations released' % released)
+
+@flask_app.cli.command('shard-product')
+@click.argument('product_id', type=int)
+@click.argument('shards', type=int)
+def shard_product_command(product_id, shards):
+    """Split a product's stock across SHARDS counter rows."""
+    if not shard_product(product_id, shards):
+        raise click.ClickException('Product not found or already sharded')
+    db.session.commit()
+    click.echo('Product %d split into %d shards' % (product_id, shards))
+
+@flask_app.cli.command('unshard-product')
+@click.argument('product_id', type=int)
+def unshard_product_command(product_id):
+    """Fold a product's stock shards back into Product.quantity."""
+    if not unshard_product(product_id):
+        raise click.ClickException('Product is not sharded')
+    db.session.commit()
+    invalidate_products([product_id])
+    click.echo('Product %d unsharded' % product_id)
+
+@flask_app.cli.command('sync-sharded-stock')
+def sync_sharded_stock_command():
+    """Write the shard totals of sharded products into Product.quantity."""
+    product_ids = sync_sharded_stock()
+    db.session.commit()
+    invalidate_products(product_ids)
+    click.echo('%d products updated' % len(product_ids))
+
+@flask_app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations."""
+    for version in migrate():
+        click.echo('Applied %s' % version)
+    click.echo('Schema is up to date')
+
+@flask_app.cli.command('migrations')
+def migrations_command():
+    """List pending schema migrations."""
+    for version, description, _ in pending_migrations():
+        click.echo('%s  %s' % (version, description))
+
+@flask_app.cli.command('explain-routes')
+@click.option('--verbose', is_flag=True, help='Print every plan, not only full scans.')
+def explain_routes_command(verbose):
+    """EXPLAIN the statements of the complex-query routes and flag full table scans.
+
+    Scans walked in primary key order and cut by LIMIT (keyset pages) are listed as bounded
+    with --verbose, not flagged."""
+    flagged = 0
+    for entry in explain_routes():
+        if not entry['full_scans'] and not verbose:
+            continue
+        flagged += bool(entry['full_scans'])
+        label = 'FULL SCAN ' if entry['full_scans'] else 'BOUNDED SCAN ' if entry['bounded_scans'] else ''
+        click.echo('%s%s' % (label, entry['route']))
+        click.echo('    ' + entry['statement'])
+        for line in entry['plan']:
+            click.echo('    | ' + line)
+    click.echo('%d statements with full scans' % flagged)
+
+@flask_app.cli.command('backfill-order-totals')
+def backfill_order_totals_command():
+    """Price unpriced order items and recompute every order's item_count and total_amount."""
+    priced = backfill_order_totals(db.session.connection())
+    db.session.commit()
+    click.echo('%d order items priced, order totals recomputed' % priced)
+
+@flask_app.cli.command('rebuild-sales-rollups')
+def rebuild_sales_rollups_command():
+    """Recompute the daily sales rollups from order items."""
+    rebuild_sales_rollups(db.session.connection())
+    db.session.commit()
+    click.echo('Sales rollups rebuilt')
+
+@flask_app.cli.command('build-recommendations')
+def build_recommendations_command():
+    """Run the co-occurrence batch build and report its size and duration."""
+    stats = recommendations.build()
+    click.echo('%(products)d products, %(pairs)d product pairs (%(engine)s, %(seconds).3fs)' % stats)
+
+@flask_app.cli.command('check-order-totals')
+@click.option('--limit', default=100, help='Report at most this many mismatched orders.')
+def check_order_totals_command(limit):
+    """Compare stored order totals with their order items; exits non-zero on a mismatch."""
+    mismatches = check_order_totals(db.session.connection(), limit)
+    for row in mismatches:
+        click.echo('order %(order_id)s: item_count %(item_count)s (expected %(expected_item_count)s), '
+                   'total_amount %(total_amount)s (expected %(expected_total_amount)s)' % row)
+    if mismatches:
+        raise click.ClickException('%d orders have inconsistent totals' % len(mismatches))
+    click.echo('Order totals are consistent')
+
+@flask_app.cli.command('export-order-items')
+@click.option('--format', 'format', default='csv', type=click.Choice(sorted(FORMATS)))
+@click.option('--watermark', default='id', type=click.Choice(WATERMARKS), help='Column the export is keyed on.')
+@click.option('--since', help='Watermark of the previous export; only newer rows are written.')
+@click.option('--output', default='-', type=click.Path(dir_okay=False, allow_dash=True), help='File to write (default: stdout).')
+def export_order_items_command(format, watermark, since, output):
+    """Export order items joined with their order, customer and product."""
+    error = check_format(format)
+    if error:
+        raise click.ClickException(error)
+    if since is not None:
+        try:
+            since = int(since) if watermark == 'id' else datetime.datetime.fromisoformat(since)
+        except ValueError:
+            raise click.BadParameter('not a valid %s watermark' % watermark, param_hint='--since')
+    until, body = export(format, watermark, since)
+    with click.open_file(output, 'wb') as f:
+        for chunk in body:
+            f.write(chunk)
+    click.echo('watermark: %s' % format_watermark(watermark, until), err=True)
@@ -0,0 +1,45 @@
+from sqlalchemy import and_, bindparam, insert, select, tuple_, update
+
+from app import db
+
+#Adds deltas to counter rows (table_versions, category_stats, sales_rollups, orders), creating
+#the rows that don't exist yet, in the caller's session. deltas maps a key (a tuple of the
+#key_columns values) to a tuple of increments for columns; all-zero deltas are skipped.
+#A single key is an UPDATE followed by an INSERT when it matched nothing. More keys read which
+#rows exist, then send one executemany UPDATE and one INSERT for the rest, so the statements
+#per write don't grow with the number of keys it touches. With create=False the rows are
+#expected to exist (orders) and all keys go in one executemany UPDATE.
+
+def add_to_rows(model, key_columns, columns, deltas, create=True):
+    deltas = {tuple(key): tuple(values) for key, values in deltas.items() if any(values)}
+    if not deltas:
+        return
+    table = model.__table__
+    keys = [table.c[name] for name in key_columns]
+    statement = update(table)\
+        .where(and_(*[column == bindparam('key_' + column.name) for column in keys]))\
+        .values({name: table.c[name] + bindparam('add_' + name) for name in columns})
+
+    def params(key, values):
+        row = {'key_' + column.name: value for column, value in zip(keys, key)}
+        row.update(('add_' + name, value) for name, value in zip(columns, values))
+        return row
+
+    if not create:
+        db.session.execute(statement, [params(key, values) for key, values in deltas.items()])
+        return
+    if len(deltas) == 1:
+        [(key, values)] = deltas.items()
+        if db.session.execute(statement, params(key, values)).rowcount:
+            return
+        missing = deltas
+    else:
+        condition = tuple_(*keys).in_(list(deltas)) if len(keys) > 1 else keys[0].in_([key[0] for key in deltas])
+        existing = {tuple(row) for row in db.session.execute(select(*keys).where(condition))}
+        found = [params(key, values) for key, values in deltas.items() if key in existing]
+        if found:
+            db.session.execute(statement, found)
+        missing = {key: values for key, values in deltas.items() if key not in existing}
+    if missing:
+        names = tuple(key_columns) + tuple(columns)
+        db.session.execute(insert(table), [dict(zip(names, key + values)) for key, values in missing.items()])
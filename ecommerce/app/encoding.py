@@ -0,0 +1,32 @@
+import datetime
+from decimal import Decimal
+
+from flask import Response, json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#JSON encoding for list responses: orjson when it is installed, Flask's encoder otherwise.
+#Both sort keys as jsonify does, and both write Decimal as a float and datetime in
+#DATE_FORMAT, as the models' to_dict do.
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime.datetime):
+        return value.strftime(DATE_FORMAT)
+    raise TypeError('%s is not JSON serializable' % type(value).__name__)
+
+#returns bytes
+
+def dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value, default=default, option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(value, default=default).encode()
+
+def json_response(value):
+    return Response(dumps(value), mimetype='application/json')
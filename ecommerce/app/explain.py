@@ -0,0 +1,105 @@
+import re
+
+from sqlalchemy import event
+
+from app import flask_app, db
+
+#Runs the complex-query routes through the test client, captures the SELECT statements
+#they send and EXPLAINs each one, flagging plans that read a whole table.
+
+ROUTES = [
+    '/categories-with-products',
+    '/avg_price_by_category',
+    '/products_quantity_per_category',
+    '/products_quantity_per_category/category?category=category 1',
+    '/orders-per-customers',
+    '/orders-per-customers/customer?id=1',
+    '/order-data-of-customers',
+    '/order-data-of-customers/customer?id=1',
+    '/num-of-orders-all-customers',
+    '/num-of-orders-customers/customer?id=1',
+    '/total-price-of-order',
+    '/total-price-of-order/order?id=1',
+    '/total-count-of-order',
+    '/total-count-of-order/order?id=1',
+    '/total-products-per-order/product?id=1',
+    '/products/cost?min_cost=10&max_cost=20',
+    '/products/stock?stock=100',
+]
+
+def capture_statements(path):
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        response = flask_app.test_client().get(path)
+        response.get_data()
+        response.close()
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+    return statements
+
+#SCAN lines of a SQLite plan that read a whole table, split into (full, bounded). A subquery
+#in FROM is planned as a co-routine or materialized under its alias (anon_1) and scanning that
+#reads the derived rows, not a table, so those are left out. A statement ending in ORDER BY ...
+#LIMIT whose plan needs no temp b-tree for the ORDER BY walks its outermost table in that order
+#(the rowid, for a plain SCAN) and stops after the page, as keyset pagination does: that scan
+#is bounded, not full.
+
+PAGED = re.compile(r'\bORDER BY\b[^()]*\bLIMIT\b[^()]*$', re.IGNORECASE)
+
+def sqlite_scans(rows, statement):
+    plan = [row[-1] for row in rows]
+    derived = {line.split(' ', 1)[1] for line in plan if line.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+    paged = PAGED.search(' '.join(statement.split())) and \
+        not any('TEMP B-TREE' in line and 'ORDER BY' in line for line in plan)
+    outer = next((row[0] for row in rows if row[1] == 0 and row[-1].startswith(('SCAN ', 'SEARCH '))), None)
+    full, bounded = [], []
+    for row in rows:
+        line = row[-1]
+        if not line.startswith('SCAN ') or 'INDEX' in line:
+            continue
+        name = line[len('SCAN '):].split(' ')[0]
+        if name in derived or name.startswith('(subquery') or line == 'SCAN CONSTANT ROW':
+            continue
+        (bounded if paged and row[0] == outer else full).append(line)
+    return full, bounded
+
+#returns (plan lines, full scan descriptions, bounded scan descriptions) for one statement
+
+def explain(connection, statement, parameters):
+    dialect = connection.dialect.name
+    bounded = []
+    if dialect == 'sqlite':
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+        plan = [row[-1] for row in rows]
+        scans, bounded = sqlite_scans(rows, statement)
+    elif dialect == 'mysql':
+        rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters).mappings().fetchall()
+        plan = ['%s type=%s key=%s rows=%s' % (row['table'], row['type'], row['key'], row['rows']) for row in rows]
+        #derived tables show up as <derived2>, <subquery2>, ...
+        scans = ['%s (%s rows)' % (row['table'], row['rows']) for row in rows
+                 if row['type'] == 'ALL' and not (row['table'] or '').startswith('<')]
+    elif dialect == 'postgresql':
+        rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters).fetchall()
+        plan = [row[0] for row in rows]
+        scans = [line.strip() for line in plan if 'Seq Scan' in line]
+    else:
+        raise ValueError('EXPLAIN is not supported for %s' % dialect)
+    return plan, scans, bounded
+
+def explain_routes(routes=ROUTES):
+    report = []
+    for path in routes:
+        statements = capture_statements(path)
+        with db.engine.connect() as connection:
+            for statement, parameters in statements:
+                plan, scans, bounded = explain(connection, statement, parameters)
+                report.append({'route': path, 'statement': ' '.join(statement.split()), 'plan': plan,
+                               'full_scans': scans, 'bounded_scans': bounded})
+    return report
@@ -0,0 +1,183 @@
+import csv
+import datetime
+import io
+import json
+from itertools import islice
+
+from sqlalchemy import func
+
+from app import flask_app, db
+from app.models import Customer, Order, OrderItem, Product
+from app.pagination import stream_query
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+#Export of the order_items x orders x customers x products join for analytics. Rows come
+#from a server-side cursor and are encoded chunk by chunk, so memory use does not grow with
+#the export. Incremental pulls pass the watermark of the previous export: by order item id
+#(rows with a greater id) or by order date (orders placed after it). Every export is bounded
+#above by the watermark taken when it starts, which is returned for the next pull, so rows
+#written while it runs are left for the next one rather than being half included.
+
+COLUMNS = [
+    ('order_item_id', OrderItem.id),
+    ('order_id', Order.id),
+    ('order_date', Order.order_date),
+    ('customer_id', Customer.id),
+    ('customer_name', Customer.name),
+    ('product_id', Product.id),
+    ('product_name', Product.name),
+    ('category_id', Product.category_id),
+    ('quantity', OrderItem.quantity),
+    ('unit_price', OrderItem.unit_price),
+]
+NAMES = [name for name, _ in COLUMNS]
+WATERMARKS = ('id', 'order_date')
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def chunk_size():
+    return int(flask_app.config.get('EXPORT_CHUNK_SIZE', 5000))
+
+def base_query():
+    return db.session.query(*[column for _, column in COLUMNS])\
+        .join(Order, OrderItem.order_id == Order.id)\
+        .join(Customer, Order.customer_id == Customer.id)\
+        .join(Product, OrderItem.product_id == Product.id)
+
+#the upper bound of an export started now
+
+def current_watermark(key):
+    if key == 'id':
+        return db.session.query(func.max(OrderItem.id)).scalar()
+    return db.session.query(func.max(Order.order_date)).scalar()
+
+def export_query(key, since, until):
+    query = base_query()
+    if key == 'id':
+        if since is not None:
+            query = query.filter(OrderItem.id > since)
+        return query.filter(OrderItem.id <= until).order_by(OrderItem.id)
+    if since is not None:
+        query = query.filter(Order.order_date > since)
+    return query.filter(Order.order_date <= until).order_by(Order.order_date, OrderItem.id)
+
+def format_watermark(key, value):
+    if value is None:
+        return ''
+    return str(value) if key == 'id' else value.isoformat()
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+#encoders: each turns an iterable of row chunks into an iterable of bytes
+
+def encode_csv(row_chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(NAMES)
+    for chunk in row_chunks:
+        for row in chunk:
+            writer.writerow([value.strftime(DATE_FORMAT) if isinstance(value, datetime.datetime) else value
+                             for value in row])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def encode_ndjson(row_chunks):
+    for chunk in row_chunks:
+        lines = []
+        for row in chunk:
+            record = dict(zip(NAMES, row))
+            record['order_date'] = record['order_date'].strftime(DATE_FORMAT)
+            if record['unit_price'] is not None:
+                record['unit_price'] = float(record['unit_price'])
+            lines.append(json.dumps(record))
+        yield ('\n'.join(lines) + '\n').encode()
+
+#pyarrow writers need a file; this one hands back whatever was written since the last drain
+
+class ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+def arrow_schema():
+    return pyarrow.schema([
+        ('order_item_id', pyarrow.int64()), ('order_id', pyarrow.int64()),
+        ('order_date', pyarrow.timestamp('us')), ('customer_id', pyarrow.int64()),
+        ('customer_name', pyarrow.string()), ('product_id', pyarrow.int64()),
+        ('product_name', pyarrow.string()), ('category_id', pyarrow.int64()),
+        ('quantity', pyarrow.int64()), ('unit_price', pyarrow.decimal128(10, 2)),
+    ])
+
+def encode_arrow(row_chunks, parquet=False):
+    schema = arrow_schema()
+    sink = ChunkSink()
+    if parquet:
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+        write = writer.write_table
+    else:
+        writer = pyarrow.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+    for chunk in row_chunks:
+        batch = pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array(column, type=field.type) for column, field in zip(zip(*chunk), schema)], schema=schema)
+        write(pyarrow.Table.from_batches([batch]) if parquet else batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+#format -> (encoder, mimetype, file extension, needs pyarrow)
+
+FORMATS = {
+    'csv': (encode_csv, 'text/csv', 'csv', False),
+    'ndjson': (encode_ndjson, 'application/x-ndjson', 'ndjson', False),
+    'arrow': (encode_arrow, 'application/vnd.apache.arrow.stream', 'arrows', True),
+    'parquet': (lambda row_chunks: encode_arrow(row_chunks, parquet=True), 'application/vnd.apache.parquet', 'parquet', True),
+}
+
+def check_format(name):
+    if name not in FORMATS:
+        return 'format must be one of: %s' % ', '.join(FORMATS)
+    if FORMATS[name][3] and pyarrow is None:
+        return 'the %s format needs pyarrow, which is not installed' % name
+    return None
+
+#returns (watermark, bytes iterator); the query only runs once the iterator is consumed
+
+def export(format, key='id', since=None):
+    encode = FORMATS[format][0]
+    until = current_watermark(key)
+    if until is None or (since is not None and until <= since):
+        return since, encode(iter(()))
+    query = export_query(key, since, until)
+    return until, encode(chunks(stream_query(query, chunk_size()), chunk_size()))
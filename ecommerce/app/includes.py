@@ -0,0 +1,76 @@
+from flask import request
+from sqlalchemy.orm import joinedload, selectinload
+
+from app.models import Cart, CartItem, Order, OrderItem
+from app.pagination import bad_request
+
+#?include=items,items.product,customer expands relationships in the response. Every included
+#path is eager loaded (selectin for collections, joined for many-to-one), so a response costs
+#one statement per collection level no matter how many rows it has.
+
+#relationship attribute names rather than attributes, since the backrefs only exist once the
+#mappers are configured
+
+RELATIONS = {
+    Order: {'items': 'order_items', 'customer': 'customer'},
+    OrderItem: {'product': 'product'},
+    Cart: {'items': 'cart_items', 'customer': 'customer'},
+    CartItem: {'product': 'product'},
+}
+
+def relations(model):
+    return {name: getattr(model, attribute) for name, attribute in RELATIONS.get(model, {}).items()}
+
+def allowed_paths(model, prefix=''):
+    paths = []
+    for name, attribute in relations(model).items():
+        path = prefix + name
+        paths.append(path)
+        paths.extend(allowed_paths(attribute.property.mapper.class_, path + '.'))
+    return paths
+
+def include_arg(model):
+    value = request.args.get('include', '')
+    includes = {path.strip() for path in value.split(',') if path.strip()}
+    unknown = includes - set(allowed_paths(model))
+    if unknown:
+        bad_request('unknown include: %s (allowed: %s)' % (', '.join(sorted(unknown)), ', '.join(allowed_paths(model))))
+    for path in list(includes):
+        while '.' in path:
+            path = path.rsplit('.', 1)[0]
+            includes.add(path)
+    return includes
+
+def loader_options(model, includes):
+    options = []
+    for path in sorted(includes):
+        option = None
+        current = model
+        for name in path.split('.'):
+            attribute = relations(current)[name]
+            loader = selectinload if attribute.property.uselist else joinedload
+            option = loader(attribute) if option is None else getattr(option, loader.__name__)(attribute)
+            current = attribute.property.mapper.class_
+        options.append(option)
+    return options
+
+def serialize(obj, includes):
+    result = obj.to_dict()
+    for name, attribute in relations(type(obj)).items():
+        if name not in includes:
+            continue
+        nested = {path[len(name) + 1:] for path in includes if path.startswith(name + '.')}
+        value = getattr(obj, attribute.key)
+        if isinstance(value, list):
+            result[name] = [serialize(item, nested) for item in value]
+        else:
+            result[name] = serialize(value, nested) if value is not None else None
+    return result
+
+#applies ?include= to a query; returns (query, row serializer)
+
+def with_includes(query, model):
+    includes = include_arg(model)
+    if includes:
+        query = query.options(*loader_options(model, includes))
+    return query, lambda row: serialize(row, includes)
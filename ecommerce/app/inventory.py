@@ -0,0 +1,267 @@
+import datetime
+import random
+
+from sqlalchemy import bindparam, delete, exists, func, insert, update
+
+from app import flask_app, db
+from app.cache import cache
+from app.category_stats import record_product_changes, snapshot_of
+from app.models import Product, Reservation, StockShard
+from app.versioning import bump_version, row_versions
+
+#Stock is only ever changed with conditional UPDATE ... WHERE quantity >= n statements,
+#so concurrent reservations never read-modify-write the same value and can't oversell.
+#
+#Hot products can be split into stock_shards rows. A reservation then takes its stock
+#from one randomly chosen shard, so concurrent checkouts of the same product lock
+#different rows. For a sharded product the shards are the source of truth and
+#Product.quantity is a reported figure refreshed by sync_sharded_stock(); the guarded
+#updates of Product.quantity never match a product that has shards, so it can't be spent.
+#Checkout takes its stock through take_stock(), after committing the cart's reservations.
+#
+#Functions here only stage changes in db.session; callers commit.
+
+def reservation_ttl():
+    return datetime.timedelta(seconds=flask_app.config.get('RESERVATION_TTL', 900))
+
+def shard_ids(product_id):
+    return [row[0] for row in db.session.query(StockShard.shard).filter(StockShard.product_id == product_id)]
+
+def unsharded():
+    return ~exists().where(StockShard.product_id == Product.id)
+
+def take_from_product(product_id, quantity):
+    return db.session.execute(
+        update(Product)
+        .where(Product.id == product_id, Product.quantity >= quantity, unsharded())
+        .values(quantity=Product.quantity - quantity)
+    ).rowcount == 1
+
+#the same for many unsharded products in one executemany; wanted is [(product_id, quantity)]
+
+def take_from_products(wanted):
+    if not wanted:
+        return True
+    table = Product.__table__
+    statement = update(table)\
+        .where(table.c.id == bindparam('product_id'), table.c.quantity >= bindparam('wanted'), unsharded())\
+        .values(quantity=table.c.quantity - bindparam('wanted'))
+    params = [{'product_id': product_id, 'wanted': quantity} for product_id, quantity in wanted]
+    if db.session.get_bind().dialect.supports_sane_multi_rowcount:
+        return db.session.execute(statement, params).rowcount == len(params)
+    return all(db.session.execute(statement, row).rowcount == 1 for row in params)
+
+def take_from_shard(product_id, shard, quantity):
+    return db.session.execute(
+        update(StockShard)
+        .where(StockShard.product_id == product_id, StockShard.shard == shard, StockShard.quantity >= quantity)
+        .values(quantity=StockShard.quantity - quantity)
+    ).rowcount == 1
+
+#takes quantity from a sharded product: from one shard when one holds enough, otherwise
+#shard by shard, largest first. Stock taken before a shortfall is left to the caller's rollback.
+
+def take_from_shards(product_id, shards, quantity):
+    random.shuffle(shards)
+    if any(take_from_shard(product_id, shard, quantity) for shard in shards):
+        return True
+    rows = db.session.query(StockShard.shard, StockShard.quantity)\
+        .filter(StockShard.product_id == product_id, StockShard.quantity > 0)\
+        .order_by(StockShard.quantity.desc()).all()
+    for shard, available in rows:
+        amount = min(available, quantity)
+        if take_from_shard(product_id, shard, amount):
+            quantity -= amount
+        if not quantity:
+            return True
+    return False
+
+def sharded_products(product_ids):
+    shards = {}
+    for product_id, shard in db.session.query(StockShard.product_id, StockShard.shard)\
+            .filter(StockShard.product_id.in_(list(product_ids))):
+        shards.setdefault(product_id, []).append(shard)
+    return shards
+
+#takes stock for a sale, sharded or not; wanted is [(product_id, quantity)]. Returns False
+#when some product is short; the caller rolls back whatever was taken.
+
+def take_stock(wanted):
+    shards = sharded_products(product_id for product_id, _ in wanted)
+    plain = [(product_id, quantity) for product_id, quantity in wanted if product_id not in shards]
+    if not take_from_products(plain):
+        return False
+    for product_id, quantity in wanted:
+        if product_id in shards and not take_from_shards(product_id, shards[product_id], quantity):
+            return False
+    stock_changed([(product_id, -quantity) for product_id, quantity in plain])
+    return True
+
+#stock a sale can take now: Product.quantity, or the sum of the shards for a sharded product
+
+def available_stock(product_ids):
+    stock = dict(db.session.query(Product.id, Product.quantity).filter(Product.id.in_(list(product_ids))))
+    stock.update((product_id, int(total)) for product_id, total in
+                 db.session.query(StockShard.product_id, func.sum(StockShard.quantity))
+                 .filter(StockShard.product_id.in_(list(product_ids)))
+                 .group_by(StockShard.product_id))
+    return stock
+
+def add_to_shard(product_id, shard, quantity):
+    return db.session.execute(
+        update(StockShard)
+        .where(StockShard.product_id == product_id, StockShard.shard == shard)
+        .values(quantity=StockShard.quantity + quantity)).rowcount == 1
+
+#returns stock to its shard, or to the product when it is unsharded (or has been unsharded
+#since the reservation was made); stock taken before the product was sharded goes to one of
+#its shards. Returns True when Product.quantity changed.
+
+def give_back(product_id, shard, quantity):
+    if shard is not None and add_to_shard(product_id, shard, quantity):
+        return False
+    shards = shard_ids(product_id)
+    if shards and add_to_shard(product_id, random.choice(shards), quantity):
+        return False
+    db.session.execute(update(Product).where(Product.id == product_id)
+                       .values(quantity=Product.quantity + quantity))
+    return True
+
+#records the stock change of unsharded products in the catalog read models
+
+def stock_changed(changes):
+    if not changes:
+        return
+    categories = dict(db.session.query(Product.id, Product.category_id)
+                      .filter(Product.id.in_([product_id for product_id, _ in changes])))
+    record_product_changes([(snapshot_of(categories[product_id], 0, 0), snapshot_of(categories[product_id], 0, delta))
+                            for product_id, delta in changes])
+    bump_version('products', *row_versions('product', sorted({product_id for product_id, _ in changes})))
+
+def invalidate_products(product_ids):
+    cache.invalidate(*['product:%s' % product_id for product_id in product_ids])
+    cache.bump('products')
+
+#reserves stock for a product; returns the pending Reservation or None when out of stock
+
+def reserve(product_id, quantity, cart_id=None, ttl=None):
+    shards = shard_ids(product_id)
+    shard = None
+    if shards:
+        random.shuffle(shards)
+        shard = next((shard for shard in shards if take_from_shard(product_id, shard, quantity)), None)
+        if shard is None:
+            return None
+    elif take_from_product(product_id, quantity):
+        stock_changed([(product_id, -quantity)])
+    else:
+        return None
+
+    now = datetime.datetime.utcnow()
+    reservation = Reservation(product_id=product_id, quantity=quantity, cart_id=cart_id, shard=shard,
+                              created_at=now, expires_at=now + (ttl or reservation_ttl()))
+    db.session.add(reservation)
+    db.session.flush()
+    return reservation
+
+def set_status(reservation_id, status):
+    return db.session.execute(
+        update(Reservation)
+        .where(Reservation.id == reservation_id, Reservation.status == 'pending')
+        .values(status=status)
+    ).rowcount == 1
+
+#marks a pending reservation as sold; the stock was already taken by reserve()
+
+def commit_reservation(reservation_id):
+    return set_status(reservation_id, 'committed')
+
+#returns the stock of a pending reservation
+
+def release_reservation(reservation_id):
+    if not set_status(reservation_id, 'released'):
+        return None
+    reservation = db.session.get(Reservation, reservation_id)
+    if give_back(reservation.product_id, reservation.shard, reservation.quantity):
+        stock_changed([(reservation.product_id, reservation.quantity)])
+    return reservation
+
+#settles a cart's pending reservations at checkout: those that fit in what the cart buys are
+#committed, the others released. wanted is [(product_id, quantity)]; returns what is left to
+#take, in the same form, and the ids of products that got stock back.
+
+def settle_cart_reservations(cart_id, wanted):
+    remaining = dict(wanted)
+    released = set()
+    pending = db.session.query(Reservation.id, Reservation.product_id, Reservation.quantity)\
+        .filter(Reservation.cart_id == cart_id, Reservation.status == 'pending')\
+        .order_by(Reservation.id).all()
+    for reservation_id, product_id, quantity in pending:
+        if quantity <= remaining.get(product_id, 0):
+            if commit_reservation(reservation_id):
+                remaining[product_id] -= quantity
+        elif release_reservation(reservation_id) is not None:
+            released.add(product_id)
+    return [(product_id, remaining[product_id]) for product_id, _ in wanted if remaining[product_id]], released
+
+#releases pending reservations past their expiry, batch by batch; returns how many were released
+
+def expire_reservations(now=None, batch_size=500):
+    now = now or datetime.datetime.utcnow()
+    released = 0
+    while True:
+        ids = [row[0] for row in db.session.query(Reservation.id)
+               .filter(Reservation.status == 'pending', Reservation.expires_at <= now)
+               .order_by(Reservation.id)
+               .limit(batch_size)]
+        if not ids:
+            return released
+        product_ids = set()
+        for reservation_id in ids:
+            reservation = release_reservation(reservation_id)
+            if reservation is not None:
+                released += 1
+                product_ids.add(reservation.product_id)
+        db.session.commit()
+        invalidate_products(product_ids)
+
+#moves a product's stock into `shards` counter rows
+
+def shard_product(product_id, shards):
+    product = db.session.get(Product, product_id)
+    if product is None or shard_ids(product_id):
+        return False
+    base, extra = divmod(product.quantity, shards)
+    db.session.execute(insert(StockShard), [
+        {'product_id': product_id, 'shard': shard, 'quantity': base + (1 if shard < extra else 0)}
+        for shard in range(shards)])
+    return True
+
+#writes the sum of each sharded product's shards back into Product.quantity
+
+def sync_sharded_stock():
+    totals = db.session.query(StockShard.product_id, func.sum(StockShard.quantity))\
+        .group_by(StockShard.product_id).all()
+    if not totals:
+        return []
+    current = dict(db.session.query(Product.id, Product.quantity)
+                   .filter(Product.id.in_([row[0] for row in totals])))
+    changes = [(product_id, int(total) - current[product_id]) for product_id, total in totals
+               if int(total) != current[product_id]]
+    for product_id, delta in changes:
+        db.session.execute(update(Product).where(Product.id == product_id)
+                           .values(quantity=Product.quantity + delta))
+    stock_changed(changes)
+    return [product_id for product_id, _ in changes]
+
+#folds a product's shards back into Product.quantity
+
+def unshard_product(product_id):
+    if not shard_ids(product_id):
+        return False
+    total = db.session.query(func.sum(StockShard.quantity)).filter(StockShard.product_id == product_id).scalar()
+    current = db.session.query(Product.quantity).filter(Product.id == product_id).scalar()
+    db.session.execute(update(Product).where(Product.id == product_id).values(quantity=int(total)))
+    db.session.execute(delete(StockShard).where(StockShard.product_id == product_id))
+    stock_changed([(product_id, int(total) - current)])
+    return True
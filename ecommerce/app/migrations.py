@@ -0,0 +1,78 @@
+import datetime
+
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+
+from app import db
+from app.models import RevokedToken, SalesRollup, SchemaMigration
+from app.category_stats import rebuild_category_stats
+from app.order_totals import backfill_order_totals
+from app.sales_rollups import rebuild_sales_rollups
+
+#Ordered schema migrations. Each one is applied once and recorded in schema_migrations;
+#`flask migrate` runs whatever is pending. Migrations must be safe on databases that were
+#created with `flask init-db` from the current models (checkfirst everywhere).
+
+def create_tables(connection):
+    db.metadata.create_all(connection)
+
+def create_model_indexes(*tables):
+    def migrate(connection):
+        for table in tables:
+            for index in db.metadata.tables[table].indexes:
+                index.create(connection, checkfirst=True)
+    return migrate
+
+def add_columns(table, *columns):
+    def migrate(connection):
+        existing = {column['name'] for column in inspect(connection).get_columns(table)}
+        for name in columns:
+            if name not in existing:
+                column = db.metadata.tables[table].c[name]
+                connection.exec_driver_sql('ALTER TABLE %s ADD COLUMN %s' % (
+                    table, CreateColumn(column).compile(dialect=connection.dialect)))
+    return migrate
+
+def order_totals(connection):
+    add_columns('orders', 'item_count', 'total_amount')(connection)
+    add_columns('order_items', 'unit_price')(connection)
+    backfill_order_totals(connection)
+
+def sales_rollups(connection):
+    SalesRollup.__table__.create(connection, checkfirst=True)
+    rebuild_sales_rollups(connection)
+
+MIGRATIONS = [
+    ('0001_create_tables', 'create tables missing from the database', create_tables),
+    ('0002_access_path_indexes', 'indexes for the joins, range filters and lookups in routes.py',
+     create_model_indexes('categories', 'products', 'orders', 'order_items')),
+    ('0003_order_totals', 'stored order item_count/total_amount and order_items.unit_price, backfilled',
+     order_totals),
+    ('0004_orders_order_date_index', 'order_date index for incremental exports by date watermark',
+     create_model_indexes('orders')),
+    ('0005_sales_rollups', 'daily sales per category, backfilled from order items', sales_rollups),
+    ('0006_reservations_cart_index', 'cart_id index for settling the reservations of a cart at checkout',
+     create_model_indexes('reservations')),
+    ('0007_revoked_tokens', 'token denylist shared by all processes',
+     lambda connection: RevokedToken.__table__.create(connection, checkfirst=True)),
+    ('0008_category_stats_backfill', 'fill category_stats from products; 0001 created it empty',
+     rebuild_category_stats),
+]
+
+def applied_versions():
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    return {row[0] for row in db.session.query(SchemaMigration.version)}
+
+def pending_migrations():
+    applied = applied_versions()
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+def migrate():
+    done = []
+    for version, description, apply in pending_migrations():
+        with db.engine.begin() as connection:
+            apply(connection)
+            connection.execute(SchemaMigration.__table__.insert().values(
+                version=version, applied_at=datetime.datetime.utcnow()))
+        done.append(version)
+    return done
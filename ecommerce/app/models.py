@@ -3,7 +3,7 @@ from app import db
 class Category(db.Model):
     __tablename__ = 'categories'
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(255), nullable=False)
+    name = db.Column(db.String(255), nullable=False, index=True)
     
     def __init__(self, name):
         self.name = name
@@ -21,6 +21,10 @@ class Product(db.Model):
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     category = db.relationship('Category', backref=db.backref('products', lazy=True))
+    __table_args__ = (db.Index('ix_products_category_id_price', 'category_id', 'price'),
+                      db.Index('ix_products_category_id_quantity', 'category_id', 'quantity'),
+                      db.Index('ix_products_price', 'price'),
+                      db.Index('ix_products_quantity', 'quantity'))
     
     def __init__(self, name, description, price, image, category_id, quantity):
         self.name = name
@@ -67,7 +71,11 @@ class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), nullable=False)
     order_date = db.Column(db.DateTime, nullable=False)
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total_amount = db.Column(db.Numeric(16,2), nullable=False, default=0, server_default='0')
     customer = db.relationship('Customer', backref=db.backref('orders', lazy=True))
+    __table_args__ = (db.Index('ix_orders_customer_id_order_date', 'customer_id', 'order_date'),
+                      db.Index('ix_orders_order_date', 'order_date'))
     
     def __init__(self, customer_id, order_date):
         self.customer_id = customer_id
@@ -75,7 +83,9 @@ class Order(db.Model):
 
     def to_dict(self):
         return {'id': self.id, 'customer_id': self.customer_id,
-                'order_date': self.order_date.strftime('%Y-%m-%d %H:%M:%S')}
+                'order_date': self.order_date.strftime('%Y-%m-%d %H:%M:%S'),
+                'item_count': self.item_count,
+                'total_amount': float(self.total_amount) if self.total_amount is not None else None}
 
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
@@ -83,20 +93,25 @@ class OrderItem(db.Model):
     order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
+    unit_price = db.Column(db.Numeric(10,2), nullable=True)
     order = db.relationship('Order', backref=db.backref('order_items', lazy=True))
     product = db.relationship('Product', backref=db.backref('order_items', lazy=True))
+    __table_args__ = (db.Index('ix_order_items_order_id_product_id', 'order_id', 'product_id'),
+                      db.Index('ix_order_items_product_id_order_id', 'product_id', 'order_id'))
     
-    def __init__(self, order_id, product_id, quantity):
+    def __init__(self, order_id, product_id, quantity, unit_price=None):
         self.order_id = order_id
         self.product_id = product_id
         self.quantity = quantity
+        self.unit_price = unit_price
 
     def to_dict(self):
         return {
             'id': self.id,
             'order_id': self.order_id,
             'product_id': self.product_id,
-            'quantity': self.quantity
+            'quantity': self.quantity,
+            'unit_price': float(self.unit_price) if self.unit_price is not None else None
         }
 
 class Cart(db.Model):
@@ -135,4 +150,140 @@ class CartItem(db.Model):
             'cart_id': self.cart_id,
             'product_id': self.product_id,
             'quantity': self.quantity
-        }
\ No newline at end of file
+        }
+
+class CategoryStats(db.Model):
+    __tablename__ = 'category_stats'
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), primary_key=True)
+    product_count = db.Column(db.Integer, nullable=False, default=0)
+    price_sum = db.Column(db.Numeric(16,2), nullable=False, default=0)
+    stock_total = db.Column(db.Integer, nullable=False, default=0)
+    category = db.relationship('Category', backref=db.backref('stats', uselist=False, lazy=True,
+                                                              cascade='all, delete-orphan'))
+
+    def __init__(self, category_id, product_count=0, price_sum=0, stock_total=0):
+        self.category_id = category_id
+        self.product_count = product_count
+        self.price_sum = price_sum
+        self.stock_total = stock_total
+
+    def to_dict(self):
+        return {
+            'category_id': self.category_id,
+            'product_count': self.product_count,
+            'price_sum': float(self.price_sum),
+            'stock_total': self.stock_total
+        }
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, name, version=0):
+        self.name = name
+        self.version = version
+
+    def to_dict(self):
+        return {'name': self.name, 'version': self.version}
+
+
+class Reservation(db.Model):
+    __tablename__ = 'reservations'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    cart_id = db.Column(db.Integer, db.ForeignKey('cart.id'), nullable=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    shard = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    created_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    __table_args__ = (db.Index('ix_reservations_status_expires_at', 'status', 'expires_at'),
+                      db.Index('ix_reservations_cart_id_status', 'cart_id', 'status'))
+
+    def __init__(self, product_id, quantity, created_at, expires_at, cart_id=None, shard=None, status='pending'):
+        self.product_id = product_id
+        self.quantity = quantity
+        self.created_at = created_at
+        self.expires_at = expires_at
+        self.cart_id = cart_id
+        self.shard = shard
+        self.status = status
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'product_id': self.product_id,
+            'cart_id': self.cart_id,
+            'quantity': self.quantity,
+            'status': self.status,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'expires_at': self.expires_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+
+class StockShard(db.Model):
+    __tablename__ = 'stock_shards'
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    quantity = db.Column(db.Integer, nullable=False)
+
+    def __init__(self, product_id, shard, quantity):
+        self.product_id = product_id
+        self.shard = shard
+        self.quantity = quantity
+
+    def to_dict(self):
+        return {'product_id': self.product_id, 'shard': self.shard, 'quantity': self.quantity}
+
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    version = db.Column(db.String(64), primary_key=True)
+    applied_at = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, version, applied_at):
+        self.version = version
+        self.applied_at = applied_at
+
+    def to_dict(self):
+        return {'version': self.version, 'applied_at': self.applied_at.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+class SalesRollup(db.Model):
+    __tablename__ = 'sales_rollups'
+    bucket_date = db.Column(db.Date, primary_key=True)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), primary_key=True, autoincrement=False)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(16,2), nullable=False, default=0)
+
+    def __init__(self, bucket_date, category_id, order_count=0, units=0, revenue=0):
+        self.bucket_date = bucket_date
+        self.category_id = category_id
+        self.order_count = order_count
+        self.units = units
+        self.revenue = revenue
+
+    def to_dict(self):
+        return {
+            'bucket_date': self.bucket_date.isoformat(),
+            'category_id': self.category_id,
+            'order_count': self.order_count,
+            'units': self.units,
+            'revenue': float(self.revenue)
+        }
+
+
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_tokens'
+    digest = db.Column(db.String(64), primary_key=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __init__(self, digest, expires_at):
+        self.digest = digest
+        self.expires_at = expires_at
+
+    def to_dict(self):
+        return {'digest': self.digest, 'expires_at': self.expires_at.strftime('%Y-%m-%d %H:%M:%S')}
@@ -0,0 +1,89 @@
+from decimal import Decimal
+
+from sqlalchemy import func, select, update
+
+from app import db
+from app.counters import add_to_rows
+from app.models import Order, OrderItem, Product
+
+#orders.item_count and orders.total_amount are the row count and sum(unit_price * quantity)
+#of an order's items, where unit_price is the product price captured when the item was
+#written. Order item writes record their before/after snapshot in the same session, so the
+#totals are committed (or rolled back) together with the items themselves.
+
+def snapshot_of(order_id, unit_price, quantity):
+    return (int(order_id), Decimal(str(unit_price or 0)), int(quantity))
+
+def snapshot(item):
+    return snapshot_of(item.order_id, item.unit_price, item.quantity)
+
+def record_item_changes(changes):
+    deltas = {}
+    for before, after in changes:
+        if before is not None:
+            order_id, unit_price, quantity = before
+            count, amount = deltas.get(order_id, (0, 0))
+            deltas[order_id] = (count - 1, amount - unit_price * quantity)
+        if after is not None:
+            order_id, unit_price, quantity = after
+            count, amount = deltas.get(order_id, (0, 0))
+            deltas[order_id] = (count + 1, amount + unit_price * quantity)
+    add_to_rows(Order, ('id',), ('item_count', 'total_amount'),
+                {(order_id,): delta for order_id, delta in deltas.items()}, create=False)
+
+def record_item_change(before=None, after=None):
+    record_item_changes([(before, after)])
+
+#fills in unit_price from the current product price for item dicts that don't carry one
+
+def price_items(items):
+    product_ids = {item['product_id'] for item in items if item.get('unit_price') is None}
+    if not product_ids:
+        return items
+    prices = dict(db.session.query(Product.id, Product.price).filter(Product.id.in_(product_ids)))
+    for item in items:
+        if item.get('unit_price') is None:
+            item['unit_price'] = prices.get(item['product_id'])
+    return items
+
+#consistency checking and backfill. Both take a connection so the backfill can also run
+#inside a migration; items written before unit_price existed are priced at today's price.
+
+def computed_totals():
+    return select(OrderItem.order_id,
+                  func.count(OrderItem.id).label('item_count'),
+                  func.coalesce(func.sum(OrderItem.unit_price * OrderItem.quantity), 0).label('total_amount'))\
+        .group_by(OrderItem.order_id).subquery()
+
+#amounts are compared in cents: SQLite keeps Numeric as a float, so a total built up by
+#incremental adds can differ from the summed one in the last bits
+
+def check_order_totals(connection, limit=100):
+    computed = computed_totals()
+    expected_count = func.coalesce(computed.c.item_count, 0)
+    expected_amount = func.coalesce(computed.c.total_amount, 0)
+    rows = connection.execute(
+        select(Order.id, Order.item_count, Order.total_amount, expected_count, expected_amount)
+        .outerjoin(computed, computed.c.order_id == Order.id)
+        .where((Order.item_count != expected_count) |
+               (func.round(Order.total_amount, 2) != func.round(expected_amount, 2)))
+        .order_by(Order.id)
+        .limit(limit))
+    return [{'order_id': row[0], 'item_count': row[1], 'expected_item_count': row[3],
+             'total_amount': float(row[2]), 'expected_total_amount': float(row[4])} for row in rows]
+
+def backfill_order_totals(connection):
+    items = OrderItem.__table__
+    products = Product.__table__
+    orders = Order.__table__
+    priced = connection.execute(
+        update(items)
+        .where(items.c.unit_price.is_(None))
+        .values(unit_price=select(products.c.price).where(products.c.id == items.c.product_id).scalar_subquery())
+    ).rowcount
+    connection.execute(update(orders).values(
+        item_count=select(func.count(items.c.id))
+            .where(items.c.order_id == orders.c.id).scalar_subquery(),
+        total_amount=select(func.coalesce(func.sum(items.c.unit_price * items.c.quantity), 0))
+            .where(items.c.order_id == orders.c.id).scalar_subquery()))
+    return priced
@@ -0,0 +1,146 @@
+import datetime
+from decimal import Decimal, InvalidOperation
+
+from flask import Response, abort, jsonify, request, stream_with_context
+
+from sqlalchemy import func, or_
+
+from app import flask_app, db
+from app.cache import cache
+from app.encoding import dumps, json_response
+from app.versioning import versioned_key
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 1000
+NEXT_CURSOR_HEADER = 'X-Next-After'
+TRUE_VALUES = ('1', 'true', 'yes')
+COUNT_ESTIMATE_HEADER = 'X-Total-Count-Estimate'
+
+def bad_request(message):
+    response = jsonify({'error': message})
+    response.status_code = 400
+    abort(response)
+
+def int_arg(name, default=None, minimum=None):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        bad_request('%s must be an integer' % name)
+    if minimum is not None and value < minimum:
+        bad_request('%s must be at least %d' % (name, minimum))
+    return value
+
+def datetime_arg(name):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        bad_request('%s must be an ISO date or datetime' % name)
+
+#reads the limit/after query parameters, aborting with 400 on bad input
+
+def limit_arg(default_limit=DEFAULT_PAGE_SIZE):
+    return min(int_arg('limit', default_limit, minimum=1), MAX_PAGE_SIZE)
+
+def page_args(default_limit=DEFAULT_PAGE_SIZE):
+    return limit_arg(default_limit), int_arg('after')
+
+def wants_stream():
+    return request.args.get('stream', '').lower() in TRUE_VALUES
+
+#runs a query's statement through a server-side cursor. The statement is only executed once
+#iteration starts, inside the streamed response, so it uses that context's session (which
+#is closed when the stream ends) rather than the view's, which is torn down before streaming
+
+def stream_query(query, chunk_size=STREAM_CHUNK_SIZE):
+    result = db.session.execute(query.statement.execution_options(yield_per=chunk_size))
+    if query.is_single_entity:
+        result = result.scalars()
+    yield from result
+
+#writes rows out as a JSON array, chunk by chunk, while they are still being fetched
+
+def stream_json(rows, serialize=None):
+    def generate():
+        yield b'['
+        chunk = []
+        first = True
+        for row in rows:
+            chunk.append(dumps(serialize(row) if serialize else row))
+            if len(chunk) == STREAM_CHUNK_SIZE:
+                yield (b'' if first else b',') + b','.join(chunk)
+                first = False
+                chunk = []
+        if chunk:
+            yield (b'' if first else b',') + b','.join(chunk)
+        yield b']'
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+#keyset pagination on an id column: ?limit=&after=<last id seen>, or ?stream=1 for everything
+#through a server-side cursor. Pages of a cache_namespace are served through the read cache,
+#keyed on ?fields= as well since projected pages differ by it, and on the table versions when
+#the route is conditional.
+
+def paginate(query, id_column, serialize=lambda row: row.to_dict(), cache_namespace=None):
+    limit, after = page_args()
+    if after is not None:
+        query = query.filter(id_column > after)
+    query = query.order_by(id_column)
+
+    if wants_stream():
+        return stream_json(stream_query(query), serialize)
+
+    def load():
+        return [serialize(row) for row in query.limit(limit)]
+
+    if cache_namespace:
+        key = cache.page_key(cache_namespace, limit, after, request.args.get('fields', ''))
+        items = cache.get_or_load(versioned_key(key), load)
+    else:
+        items = load()
+    response = json_response(items)
+    if len(items) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(items[-1]['id'])
+    return response
+
+#keyset pagination ordered by (column, id) for range scans on an indexed column. The cursor is
+#"<value>:<id>" of the last row seen; the first page also reports a row count estimate that is
+#exact up to COUNT_ESTIMATE_CAP and "<cap>+" above it, so it never costs more than cap rows.
+
+def parse_cursor(cast):
+    cursor = request.args.get('after')
+    if not cursor:
+        return None
+    value, _, id = cursor.rpartition(':')
+    try:
+        return cast(value), int(id)
+    except (ValueError, InvalidOperation):
+        bad_request('after must be a cursor returned in %s' % NEXT_CURSOR_HEADER)
+
+def count_estimate(query):
+    cap = flask_app.config.get('COUNT_ESTIMATE_CAP', 10000)
+    rows = db.session.query(func.count()).select_from(query.with_entities(1).limit(cap + 1).subquery()).scalar()
+    return str(rows) if rows <= cap else '%d+' % cap
+
+def paginate_range(query, column, id_column, cast=Decimal, serialize=lambda row: row.to_dict()):
+    limit = limit_arg()
+    cursor = parse_cursor(cast)
+    estimate = count_estimate(query) if cursor is None else None
+    if cursor is not None:
+        value, id = cursor
+        query = query.filter(column >= value, or_(column > value, id_column > id))
+    rows = query.order_by(column, id_column).limit(limit).all()
+
+    response = json_response([serialize(row) for row in rows])
+    if len(rows) == limit:
+        last = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = '%s:%s' % (getattr(last, column.key), getattr(last, id_column.key))
+    if estimate is not None:
+        response.headers[COUNT_ESTIMATE_HEADER] = estimate
+    return response
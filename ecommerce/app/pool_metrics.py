@@ -0,0 +1,58 @@
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+#counters for how long requests wait for a pooled connection and how often the pool runs dry
+
+class PoolMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.exhausted = 0
+
+    def record_wait(self, seconds):
+        with self.lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+    def record_exhausted(self):
+        with self.lock:
+            self.exhausted += 1
+
+    def to_dict(self, pool=None):
+        result = {
+            'checkouts': self.checkouts,
+            'avg_wait_ms': self.total_wait * 1000 / self.checkouts if self.checkouts else 0.0,
+            'max_wait_ms': self.max_wait * 1000,
+            'total_wait_ms': self.total_wait * 1000,
+            'exhausted': self.exhausted
+        }
+        if isinstance(pool, QueuePool):
+            result.update({
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': pool.overflow()
+            })
+        return result
+
+pool_metrics = PoolMetrics()
+
+class InstrumentedQueuePool(QueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.record_exhausted()
+            raise
+        pool_metrics.record_wait(time.perf_counter() - start)
+        return connection
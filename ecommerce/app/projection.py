@@ -0,0 +1,65 @@
+from flask import request
+from sqlalchemy import DateTime, Numeric
+
+from app.models import Cart, CartItem, Category, Customer, Order, OrderItem, Product
+from app.encoding import DATE_FORMAT
+from app.pagination import bad_request
+
+#List routes select only the columns they return, as tuples, instead of hydrating ORM objects
+#and calling to_dict on each one; ?fields=id,name,price narrows that further. Rows are turned
+#into the same dicts to_dict builds (Numeric as float, DateTime as DATE_FORMAT); the pages are
+#encoded by app.encoding.
+
+#the fields of each model's to_dict, in order
+FIELDS = {
+    Category: ('id', 'name'),
+    Product: ('id', 'name', 'description', 'price', 'image', 'category_id', 'quantity'),
+    Customer: ('id', 'name', 'email', 'phone', 'address', 'city', 'state', 'zip', 'country'),
+    Order: ('id', 'customer_id', 'order_date', 'item_count', 'total_amount'),
+    OrderItem: ('id', 'order_id', 'product_id', 'quantity', 'unit_price'),
+    Cart: ('id', 'customer_id'),
+    CartItem: ('id', 'cart_id', 'product_id', 'quantity'),
+}
+
+def converter(column):
+    if isinstance(column.type, Numeric):
+        return float
+    if isinstance(column.type, DateTime):
+        return lambda value: value.strftime(DATE_FORMAT)
+    return None
+
+#?fields= as a list of the model's fields; id is always returned since pages are keyed on it
+
+def fields_arg(model):
+    value = request.args.get('fields', '')
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    if not fields:
+        return list(FIELDS[model])
+    unknown = set(fields) - set(FIELDS[model])
+    if unknown:
+        bad_request('unknown fields: %s (allowed: %s)' % (', '.join(sorted(unknown)), ', '.join(FIELDS[model])))
+    return ['id'] + [field for field in dict.fromkeys(fields) if field != 'id']
+
+class Projection:
+    def __init__(self, model, fields, extra=()):
+        self.names = list(fields)
+        columns = [getattr(model, name) for name in self.names]
+        #columns the caller needs on the row (e.g. a sort key) but did not ask to return go
+        #last, where zip with the names drops them
+        self.columns = columns + [column for column in extra if column.key not in self.names]
+        self.converted = [(name, convert) for name, convert in
+                          ((name, converter(column)) for name, column in zip(self.names, columns)) if convert]
+
+    def __call__(self, row):
+        record = dict(zip(self.names, row))
+        for name, convert in self.converted:
+            value = record[name]
+            if value is not None:
+                record[name] = convert(value)
+        return record
+
+#narrows a query on model to the requested fields; returns (query, row serializer)
+
+def projected(query, model, *extra):
+    projection = Projection(model, fields_arg(model), extra)
+    return query.with_entities(*projection.columns).only_return_tuples(True), projection
@@ -0,0 +1,181 @@
+import heapq
+import threading
+import time
+from collections import defaultdict
+from itertools import combinations, groupby
+
+from sqlalchemy import func
+
+from app import flask_app, db
+from app.models import OrderItem
+
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    numpy = None
+
+#"Frequently bought together": for every product, the products that appear in the most orders
+#with it. The batch build reads (order_id, product_id) from order_items once and computes the
+#co-occurrence matrix as incidence.T @ incidence with SciPy (or with plain dicts when SciPy is
+#not installed); the per-product top-k lists are precomputed from it. Order item writes then
+#adjust the counts of the orders they touched after commit, and a full rebuild runs in the
+#background every RECOMMENDATIONS_REBUILD_SECONDS to pick up other processes' writes.
+
+BUILD_CHUNK_SIZE = 5000
+
+def order_products():
+    rows = db.session.execute(db.select(OrderItem.order_id, OrderItem.product_id)
+                              .order_by(OrderItem.order_id)
+                              .execution_options(yield_per=BUILD_CHUNK_SIZE))
+    for order_id, items in groupby(rows, key=lambda row: row[0]):
+        yield order_id, {product_id for _, product_id in items}
+
+def cooccurrence_python(baskets):
+    counts = defaultdict(lambda: defaultdict(int))
+    for _, products in baskets:
+        for a, b in combinations(sorted(products), 2):
+            counts[a][b] += 1
+            counts[b][a] += 1
+    return counts
+
+def cooccurrence_scipy(baskets):
+    rows = []
+    columns = []
+    for row, (_, products) in enumerate(baskets):
+        rows.extend([row] * len(products))
+        columns.extend(products)
+    if not columns:
+        return {}
+    products, columns = numpy.unique(numpy.asarray(columns, dtype=numpy.int64), return_inverse=True)
+    incidence = scipy.sparse.csr_matrix(
+        (numpy.ones(len(columns), dtype=numpy.int32), (numpy.asarray(rows), columns)),
+        shape=(rows[-1] + 1, len(products)))
+    matrix = (incidence.T @ incidence).tocsr()
+    matrix.setdiag(0)
+    matrix.eliminate_zeros()
+    counts = {}
+    for index, product_id in enumerate(products.tolist()):
+        start, end = matrix.indptr[index], matrix.indptr[index + 1]
+        if start < end:
+            counts[product_id] = dict(zip(products[matrix.indices[start:end]].tolist(),
+                                          matrix.data[start:end].tolist()))
+    return counts
+
+def ranked(row, k):
+    return heapq.nsmallest(k, ((-count, product_id) for product_id, count in row.items() if count > 0))
+
+class Recommendations:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.rebuilding = False
+        self.built_at = None
+        self.counts = {}
+        self.top = {}
+
+    def k(self):
+        return flask_app.config.get('RECOMMENDATIONS_TOP_K', 20)
+
+    def build(self):
+        started = time.perf_counter()
+        if numpy is not None:
+            counts = cooccurrence_scipy(order_products())
+        else:
+            counts = cooccurrence_python(order_products())
+        counts = {product_id: dict(row) for product_id, row in counts.items()}
+        k = self.k()
+        top = {product_id: ranked(row, k) for product_id, row in counts.items()}
+        with self.lock:
+            self.counts, self.top = counts, top
+            self.built_at = time.monotonic()
+        return {'products': len(counts), 'pairs': sum(len(row) for row in counts.values()) // 2,
+                'engine': 'scipy' if numpy is not None else 'python',
+                'seconds': round(time.perf_counter() - started, 3)}
+
+    def rebuild_in_background(self):
+        with self.lock:
+            if self.rebuilding:
+                return
+            self.rebuilding = True
+
+        def run():
+            try:
+                with flask_app.app_context():
+                    self.build()
+            finally:
+                self.rebuilding = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def ensure_fresh(self):
+        if self.built_at is None:
+            with self.lock:
+                if self.built_at is None:
+                    self.build()
+            return
+        if time.monotonic() - self.built_at >= flask_app.config.get('RECOMMENDATIONS_REBUILD_SECONDS', 3600):
+            self.rebuild_in_background()
+
+    #adds delta to the pair count in both directions and keeps both top-k lists exact: an
+    #increase can only move that product up, a decrease re-ranks the row
+
+    def bump(self, a, b, delta):
+        k = self.k()
+        for product_id, other in ((a, b), (b, a)):
+            row = self.counts.setdefault(product_id, {})
+            count = row.get(other, 0) + delta
+            if count > 0:
+                row[other] = count
+            else:
+                row.pop(other, None)
+            top = self.top.get(product_id, [])
+            if delta > 0 and len(top) == k and (-count, other) > top[-1] and all(entry[1] != other for entry in top):
+                continue
+            self.top[product_id] = ranked(row, k)
+
+    #changes are (before, after) snapshots of (order_id, product_id, ...) as recorded for the
+    #sales rollups; called after commit. Only products entering or leaving an order move counts.
+
+    def record_changes(self, changes):
+        if self.built_at is None:
+            return
+        net = defaultdict(int)
+        for before, after in changes:
+            if before is not None:
+                net[(before[0], before[1])] -= 1
+            if after is not None:
+                net[(after[0], after[1])] += 1
+        net = {key: value for key, value in net.items() if value}
+        if not net:
+            return
+        lines = defaultdict(dict)
+        for order_id, product_id, count in db.session.query(OrderItem.order_id, OrderItem.product_id, func.count(OrderItem.id))\
+                .filter(OrderItem.order_id.in_({order_id for order_id, _ in net}))\
+                .group_by(OrderItem.order_id, OrderItem.product_id):
+            lines[order_id][product_id] = count
+
+        with self.lock:
+            for order_id in {order_id for order_id, _ in net}:
+                now = lines.get(order_id, {})
+                after = {product_id for product_id, count in now.items() if count > 0}
+                before = {product_id for product_id in set(now) | {p for o, p in net if o == order_id}
+                          if now.get(product_id, 0) - net.get((order_id, product_id), 0) > 0}
+                removed = before - after
+                added = after - before
+                for product_id in removed:
+                    for other in before - {product_id}:
+                        if other not in removed or other > product_id:
+                            self.bump(product_id, other, -1)
+                for product_id in added:
+                    for other in after - {product_id}:
+                        if other not in added or other > product_id:
+                            self.bump(product_id, other, 1)
+
+    #returns [(product_id, orders together)], most frequent first
+
+    def recommend(self, product_id, limit=10):
+        self.ensure_fresh()
+        with self.lock:
+            return [(other, -count) for count, other in self.top.get(product_id, [])[:limit]]
+
+recommendations = Recommendations()
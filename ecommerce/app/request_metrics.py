@@ -0,0 +1,221 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from flask import request
+from sqlalchemy import event
+
+#Per-route request metrics in the Prometheus text format: latency histogram, status counts,
+#response bytes and the SQL each request issued (statements, time in the database and the
+#rows the driver reports). Engine events attribute statements to the current request through
+#a context variable (cheaper per statement than going through flask.g); the totals are
+#recorded on request teardown or, for streamed responses (whose body runs after the first
+#teardown), once the last chunk has been sent.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+#PoolMetrics.to_dict() keys exported as (metric, type, scale)
+POOL_METRICS = (
+    ('checkouts', 'ecommerce_db_pool_checkouts_total', 'counter', 1),
+    ('total_wait_ms', 'ecommerce_db_pool_wait_seconds_total', 'counter', 0.001),
+    ('max_wait_ms', 'ecommerce_db_pool_max_wait_seconds', 'gauge', 0.001),
+    ('exhausted', 'ecommerce_db_pool_exhausted_total', 'counter', 1),
+    ('size', 'ecommerce_db_pool_size', 'gauge', 1),
+    ('checked_out', 'ecommerce_db_pool_checked_out', 'gauge', 1),
+    ('checked_in', 'ecommerce_db_pool_checked_in', 'gauge', 1),
+    ('overflow', 'ecommerce_db_pool_overflow', 'gauge', 1),
+)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield '%g' % bound, cumulative
+        yield '+Inf', self.count
+
+class RouteStats:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statements_per_request = Histogram(STATEMENT_BUCKETS)
+        self.statuses = {}
+        self.response_bytes = 0
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.sql_rows = 0
+
+#the per-request accumulator, held in current_request while the request runs
+
+class RequestState:
+    __slots__ = ('start', 'status', 'streamed', 'response_bytes', 'sql_statements', 'sql_seconds', 'sql_rows')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.status = 500
+        self.streamed = False
+        self.response_bytes = 0
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.sql_rows = 0
+
+current_request = ContextVar('request_metrics', default=None)
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def route_of(request):
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def labels(**values):
+    return '{%s}' % ','.join('%s="%s"' % (key, escape(value)) for key, value in values.items())
+
+class RequestMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.engines = []
+        self.enabled = True
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+
+    #Flask hooks
+
+    def init_app(self, app):
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def before_request(self):
+        if self.enabled:
+            current_request.set(RequestState())
+
+    def after_request(self, response):
+        state = current_request.get()
+        if state is None:
+            return response
+        state.status = response.status_code
+        if response.is_streamed:
+            state.streamed = True
+            response.response = self.stream(response.response, state, request.method, route_of(request))
+        else:
+            state.response_bytes = response.content_length or 0
+        return response
+
+    def stream(self, chunks, state, method, route):
+        try:
+            for chunk in chunks:
+                state.response_bytes += len(chunk)
+                yield chunk
+        finally:
+            current_request.set(None)
+            self.record(method, route, state, time.perf_counter() - state.start)
+
+    def teardown_request(self, exception=None):
+        state = current_request.get()
+        if state is None or state.streamed:
+            return
+        current_request.set(None)
+        self.record(request.method, route_of(request), state, time.perf_counter() - state.start)
+
+    def record(self, method, route, state, seconds):
+        with self.lock:
+            stats = self.routes.get((method, route))
+            if stats is None:
+                stats = self.routes[(method, route)] = RouteStats()
+            stats.latency.observe(seconds)
+            stats.statements_per_request.observe(state.sql_statements)
+            stats.statuses[state.status] = stats.statuses.get(state.status, 0) + 1
+            stats.response_bytes += state.response_bytes
+            stats.sql_statements += state.sql_statements
+            stats.sql_seconds += state.sql_seconds
+            stats.sql_rows += state.sql_rows
+
+    #engine events
+
+    def instrument(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+        self.engines.append(engine)
+
+    def remove(self, engine):
+        event.remove(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.remove(engine, 'after_cursor_execute', self.after_cursor_execute)
+        self.engines.remove(engine)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if current_request.get() is not None:
+            context.request_metrics_start = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        state = current_request.get()
+        if state is None:
+            return
+        state.sql_statements += 1
+        state.sql_seconds += time.perf_counter() - context.request_metrics_start
+        if cursor.rowcount >= 0:
+            state.sql_rows += cursor.rowcount
+
+    #exposition
+
+    def render(self, pool_stats=None):
+        with self.lock:
+            routes = sorted(self.routes.items())
+            lines = []
+
+            def family(name, kind, help, samples):
+                lines.append('# HELP %s %s' % (name, help))
+                lines.append('# TYPE %s %s' % (name, kind))
+                lines.extend('%s%s %s' % (sample, label, value) for sample, label, value in samples)
+
+            family('ecommerce_http_requests_total', 'counter', 'Requests by route and status.',
+                   [('ecommerce_http_requests_total', labels(method=method, route=route, status=status), count)
+                    for (method, route), stats in routes for status, count in sorted(stats.statuses.items())])
+            for name, attribute, help in (
+                    ('ecommerce_http_request_duration_seconds', 'latency', 'Request latency, including streaming.'),
+                    ('ecommerce_sql_statements_per_request', 'statements_per_request', 'SQL statements issued per request.')):
+                samples = []
+                for (method, route), stats in routes:
+                    histogram = getattr(stats, attribute)
+                    for bound, count in histogram.samples():
+                        samples.append((name + '_bucket', labels(method=method, route=route, le=bound), count))
+                    samples.append((name + '_sum', labels(method=method, route=route), '%r' % histogram.sum))
+                    samples.append((name + '_count', labels(method=method, route=route), histogram.count))
+                family(name, 'histogram', help, samples)
+            for name, attribute, help in (
+                    ('ecommerce_http_response_bytes_total', 'response_bytes', 'Response body bytes sent.'),
+                    ('ecommerce_sql_statements_total', 'sql_statements', 'SQL statements issued.'),
+                    ('ecommerce_sql_duration_seconds_total', 'sql_seconds', 'Time spent executing SQL statements.'),
+                    ('ecommerce_sql_rows_total', 'sql_rows', 'Rows affected or fetched, as reported by the driver.')):
+                family(name, 'counter', help,
+                       [(name, labels(method=method, route=route), getattr(stats, attribute)) for (method, route), stats in routes])
+
+        for key, name, kind, scale in POOL_METRICS:
+            if pool_stats and key in pool_stats:
+                lines.append('# TYPE %s %s' % (name, kind))
+                lines.append('%s %r' % (name, pool_stats[key] * scale))
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+
+def configure_request_metrics(app, db):
+    if not app.config['METRICS_ENABLED']:
+        return
+    request_metrics.init_app(app)
+    with app.app_context():
+        request_metrics.instrument(db.engine)
@@ -1,10 +1,30 @@
-from flask import jsonify ,request, make_response
-from sqlalchemy import func
-from app.models import Category,Product,Customer,Order,OrderItem,Cart,CartItem
+from flask import jsonify ,request, make_response, Response, stream_with_context
+from sqlalchemy import func, and_, true, delete, insert
+from app.models import Category,Product,Customer,Order,OrderItem,Cart,CartItem,CategoryStats,Reservation
+from app.category_stats import record_product_change, record_product_changes, snapshot, snapshot_of
+from app.bulk import run_bulk, create_chunk, validate, insert_rows, update_rows, created, updated, failed
 from app import flask_app, db
+from app.cache import cache
+from app.token_cache import token_cache
+from app.pool_metrics import pool_metrics
+from app.request_metrics import request_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from app.slow_queries import slow_query_log
+from app.sales_rollups import record_sales_change, record_sales_changes, move_order, sales_report, GRANULARITIES, snapshot as sales_snapshot, snapshot_of as sales_snapshot_of
+from app.recommendations import recommendations
+from app.best_sellers import best_sellers, SCOPES as BEST_SELLER_SCOPES
+from app.export import export, check_format, format_watermark, FORMATS, WATERMARKS
+from app.inventory import reserve, commit_reservation, release_reservation, invalidate_products, settle_cart_reservations, take_stock, available_stock
+from app.versioning import bump_version, conditional, current_versions, row_versions, versioned_key
+from app.search import search_index
+from app.includes import with_includes
+from app.projection import projected
+from app.order_totals import record_item_change, record_item_changes, price_items, snapshot as item_snapshot, snapshot_of as item_snapshot_of
+from app.pagination import bad_request, paginate, paginate_range, limit_arg, page_args, TRUE_VALUES, int_arg, datetime_arg, stream_json, stream_query, NEXT_CURSOR_HEADER
 import jwt
 import datetime
 from functools import wraps
+from itertools import groupby
+from decimal import Decimal, InvalidOperation
 
 def token_required(f):
     @wraps(f)
@@ -12,16 +32,14 @@ def token_required(f):
         token = None
         
         if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            token = auth_header.split(' ')[1]
-            print(token)
-            print(flask_app.config['SECRET_KEY'])
+            auth_header = request.headers['Authorization'].split(' ')
+            token = auth_header[1] if len(auth_header) > 1 else None
         
         if not token:
             return jsonify({'message': 'Token is missing'}), 401
         
         try:
-            print(jwt.decode(token, flask_app.config['SECRET_KEY'], algorithms=["HS256"]))
+            token_cache.verify(token, flask_app.config['SECRET_KEY'])
 
         except jwt.InvalidTokenError:
             return jsonify({'message': 'Token is Invalid'}), 401
@@ -37,13 +55,43 @@ def login():
     auth = request.authorization
     
     if auth and auth.password == 'tal':
-        print(flask_app.config['SECRET_KEY'])
         token = jwt.encode({'user': auth.username, 'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=250)}, flask_app.config['SECRET_KEY'])
-        print(token)
         return jsonify({'token': token})
     return make_response('Could not verify!',401, {'WWW-Authenticate': 'Basic realm="Login Required'})    
         
 
+@flask_app.route('/metrics/pool', methods=['GET'])
+def get_pool_metrics():
+    return jsonify(pool_metrics.to_dict(db.engine.pool))
+
+#Prometheus scrape endpoint: per-route request/SQL metrics plus the connection pool gauges
+
+@flask_app.route('/metrics', methods=['GET'])
+def get_metrics():
+    body = request_metrics.render(pool_metrics.to_dict(db.engine.pool))
+    return flask_app.response_class(body, mimetype=None, content_type=METRICS_CONTENT_TYPE)
+
+@flask_app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    stats = cache.stats()
+    stats['tokens'] = token_cache.stats()
+    return jsonify(stats)
+
+#most recent slow statements first, with their plans; ?limit= caps the list
+
+@flask_app.route('/admin/slow-queries', methods=['GET'])
+@token_required
+def get_slow_queries():
+    limit = int_arg('limit', minimum=1)
+    return jsonify({'stats': slow_query_log.stats(), 'queries': slow_query_log.recent(limit)})
+
+@flask_app.route('/logout', methods=['POST'])
+@token_required
+def logout():
+    token_cache.revoke(request.headers['Authorization'].split(' ')[1], flask_app.config['SECRET_KEY'])
+    db.session.commit()
+    return jsonify({'message': 'Token revoked'})
+
 #Simple CRUD operations
 
 @flask_app.route('/categories', methods=['POST'])
@@ -52,20 +100,29 @@ def create_category():
     name = request.json.get('name')
     category = Category(name=name)
     db.session.add(category)
+    bump_version('categories')
     db.session.commit()
+    cache.bump('categories')
     return jsonify(category.to_dict()), 201
 
 @flask_app.route('/categories',methods=['GET'])
+@conditional('categories')
 def get_categories():
-    categories = Category.query.all()
-    serialized_categories = [category.to_dict() for category in categories]
-    return jsonify(serialized_categories)
+    def load():
+        return [category.to_dict() for category in Category.query.all()]
+    return jsonify(cache.get_or_load(versioned_key(cache.page_key('categories')), load))
 
 @flask_app.route('/categories/category',methods=['GET'])
+@conditional('categories')
 def get_category():
     id = request.args.get('category')
-    category = Category.query.filter_by(id == Category.id).first()
-    return jsonify(category.to_dict())
+    def load():
+        category = Category.query.get(id)
+        return category.to_dict() if category else None
+    category = cache.get_or_load(versioned_key('category:%s' % id), load)
+    if not category:
+        return jsonify({'error': 'Category not found'}), 404
+    return jsonify(category)
 
 @flask_app.route('/categories/category', methods=['PUT'])
 @token_required
@@ -75,7 +132,10 @@ def update_category():
     if not category:
         return jsonify({'error': 'Category not found'}), 404
     category.name = request.json.get('name', category.name)
+    bump_version('categories')
     db.session.commit()
+    cache.invalidate('category:%s' % category.id)
+    cache.bump('categories')
     return jsonify({'id': category.id, 'name': category.name})
 
 @flask_app.route('/categories/category', methods=['DELETE'])
@@ -86,7 +146,10 @@ def delete_category():
     if not category:
         return jsonify({'error': 'Category not found'}), 404
     db.session.delete(category)
+    bump_version('categories')
     db.session.commit()
+    cache.invalidate('category:%s' % id)
+    cache.bump('categories')
     return jsonify({'message': 'Category deleted successfully'})
 
 
@@ -96,29 +159,117 @@ def create_product():
     data = request.get_json()
     product = Product(**data)
     db.session.add(product)
+    record_product_change(after=snapshot(product))
+    bump_version('products', 'product_search')
     db.session.commit()
+    cache.bump('products')
+    search_index.reindex([product.id])
     return jsonify(product.to_dict())
 
+#creates products in bulk; with ?upsert=1 items whose id already exists update that product
+
+@flask_app.route('/products/bulk', methods=['POST'])
+@token_required
+def bulk_create_products():
+    upsert = request.args.get('upsert', '').lower() in TRUE_VALUES
+
+    def write(chunk):
+        existing = {}
+        ids = [item['id'] for _, item in chunk if item.get('id') is not None]
+        if upsert and ids:
+            rows = db.session.query(Product.id, Product.category_id, Product.price, Product.quantity)\
+                .filter(Product.id.in_(ids))
+            existing = {row[0]: snapshot_of(row[1], row[2], row[3]) for row in rows}
+
+        results, inserts, updates, changes = [], [], [], []
+        for index, item in chunk:
+            before = existing.get(item.get('id'))
+            if before is None:
+                error = validate(Product, item)
+                if error:
+                    results.append(failed(index, error))
+                    continue
+                inserts.append((index, item))
+                changes.append((None, snapshot_of(item['category_id'], item['price'], item['quantity'])))
+            else:
+                after = snapshot_of(item.get('category_id', before[0]), item.get('price', before[1]),
+                                    item.get('quantity', before[2]))
+                updates.append((index, item))
+                changes.append((before, after))
+                existing[item['id']] = after
+
+        if inserts:
+            ids = insert_rows(Product, [item for _, item in inserts])
+            results.extend(created(index, id) for (index, _), id in zip(inserts, ids))
+        if updates:
+            update_rows(Product, [item for _, item in updates])
+            results.extend(updated(index, item['id']) for index, item in updates)
+        record_product_changes(changes)
+        bump_version('products', 'product_search', *row_versions('product', [item['id'] for _, item in updates]))
+        return results
+
+    def after_commit(results):
+        invalidate_products([result['id'] for result in results if result['status'] == 'updated'])
+        search_index.reindex([result.get('id') for result in results if result['status'] != 'error'])
+
+    return jsonify(run_bulk(Product, write, partial=upsert, after_commit=after_commit))
+
+#full-text search over product name and description: ranked results, category facets and
+#offset pagination (?q=&category=&limit=&offset=)
+
+@flask_app.route('/products/search', methods=['GET'])
+def search_products():
+    text = request.args.get('q', '')
+    category = int_arg('category')
+    limit = limit_arg(20)
+    offset = int_arg('offset', 0, minimum=0)
+
+    search_index.ensure_fresh()
+    total, page, facets = search_index.search(text, category, limit, offset)
+
+    products = {product.id: product for product in Product.query.filter(Product.id.in_([id for id, _ in page]))}
+    results = []
+    for id, score in page:
+        if id in products:
+            result = products[id].to_dict()
+            result['score'] = score
+            results.append(result)
+    names = dict(db.session.query(Category.id, Category.name).filter(Category.id.in_(list(facets))))
+    return jsonify({
+        'total': total,
+        'results': results,
+        'facets': [{'category_id': id, 'category_name': names.get(id), 'count': count}
+                   for id, count in sorted(facets.items(), key=lambda facet: (-facet[1], facet[0]))]
+    })
+
 @flask_app.route('/products/product', methods=['GET'])
+@conditional('products')
 def read_product():
     product_id = request.args.get('product')
-    product = Product.query.get_or_404(product_id)
-    return jsonify(product.to_dict())
+    def load():
+        return Product.query.get_or_404(product_id).to_dict()
+    return jsonify(cache.get_or_load(versioned_key('product:%s' % product_id), load))
 
 @flask_app.route('/products', methods=['GET'])
+@conditional('products')
 def read_all_products():
-    products = Product.query.all()
-    return jsonify([product.to_dict() for product in products])
+    products, serialize = projected(Product.query, Product)
+    return paginate(products, Product.id, serialize, cache_namespace='products')
 
 @flask_app.route('/products/product', methods=['PUT'])
 @token_required
 def update_product():
     product_id = request.args.get('product')
     product = Product.query.get_or_404(product_id)
+    before = snapshot(product)
     data = request.get_json()
     for key, value in data.items():
         setattr(product, key, value)
+    record_product_change(before, snapshot(product))
+    bump_version('products', 'product_search', *row_versions('product', [product.id]))
     db.session.commit()
+    invalidate_products([product.id])
+    search_index.reindex([product.id])
     return jsonify(product.to_dict())
 
 @flask_app.route('/products/product', methods=['DELETE'])
@@ -126,8 +277,12 @@ def update_product():
 def delete_product():
     product_id = request.args.get('product')
     product = Product.query.get_or_404(product_id)
+    record_product_change(before=snapshot(product))
     db.session.delete(product)
+    bump_version('products', 'product_search', *row_versions('product', [int(product_id)]))
     db.session.commit()
+    invalidate_products([product_id])
+    search_index.reindex([int(product_id)])
     return '', 204
 
 @flask_app.route('/customers', methods=['POST'])
@@ -141,8 +296,8 @@ def create_customer():
 
 @flask_app.route('/customers', methods=['GET'])
 def get_customers():
-    customers = Customer.query.all()
-    return jsonify([customer.to_dict() for customer in customers])
+    customers, serialize = projected(Customer.query, Customer)
+    return paginate(customers, Customer.id, serialize)
 
 @flask_app.route('/customers/customer', methods=['GET'])
 def get_customer():
@@ -172,34 +327,59 @@ def delete_customer():
     db.session.commit()
     return jsonify({'message': 'Customer deleted successfully'})
 
+#order_date arrives as an ISO string in the JSON body; the DateTime column needs a datetime
+
+def parse_order_date(data):
+    value = data.get('order_date')
+    if isinstance(value, str):
+        try:
+            data['order_date'] = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            bad_request('order_date must be an ISO date or datetime')
+    return data
+
 @flask_app.route('/orders', methods=['POST'])
 @token_required
 def create_order():
-    data = request.get_json()
+    data = parse_order_date(request.get_json())
     order = Order(**data)
     db.session.add(order)
     db.session.commit()
     return jsonify(order.to_dict())
 
+#lists are read as projected tuples unless ?include= asks for related objects, which needs
+#the ORM instances
+
+def list_query(query, model):
+    if not request.args.get('include'):
+        return projected(query, model)
+    if request.args.get('fields'):
+        bad_request('fields cannot be combined with include')
+    return with_includes(query, model)
+
 @flask_app.route('/orders', methods=['GET'])
 def get_orders():
-    orders = Order.query.all()
-    return jsonify([order.to_dict() for order in orders])
+    orders, serialize = list_query(Order.query, Order)
+    return paginate(orders, Order.id, serialize)
 
 @flask_app.route('/orders/order' ,methods=['GET'])
 def get_order():
     id = request.args.get('order')
-    order = Order.query.get_or_404(id)
-    return jsonify(order.to_dict())
+    orders, serialize = with_includes(Order.query, Order)
+    order = orders.filter(Order.id == id).first_or_404()
+    return jsonify(serialize(order))
 
 @flask_app.route('/orders/order', methods=['PUT'])
 @token_required
 def update_order():
     id = request.args.get('order')
     order = Order.query.get_or_404(id)
-    data = request.get_json()
+    old_date = order.order_date
+    data = parse_order_date(request.get_json())
     for key, value in data.items():
         setattr(order, key, value)
+    if 'order_date' in data:
+        move_order(order.id, old_date, order.order_date)
     db.session.commit()
     db.session.commit()
     return jsonify(order.to_dict())
@@ -216,16 +396,45 @@ def delete_order():
 @flask_app.route('/order-items', methods=['POST'])
 @token_required
 def create_order_item():
-    data = request.get_json()
+    data = price_items([request.get_json()])[0]
     order_item = OrderItem(**data)
     db.session.add(order_item)
+    record_item_change(after=item_snapshot(order_item))
+    sales_after = sales_snapshot(order_item)
+    record_sales_change(after=sales_after)
     db.session.commit()
+    record_sold([(None, sales_after)])
     return jsonify(order_item.to_dict())        
    
+#feeds committed order item changes to the in-process best sellers and recommendations
+
+def record_sold(changes):
+    best_sellers.record_changes(changes)
+    recommendations.record_changes(changes)
+
+#order items are priced at the current product price unless the item carries a unit_price;
+#the chunk's sales changes are left in `sold` for record_sold after commit
+
+def create_order_item_chunk(chunk, sold):
+    rows = price_items([item for _, item in chunk])
+    ids = insert_rows(OrderItem, rows)
+    record_item_changes([(None, item_snapshot_of(row['order_id'], row['unit_price'], row['quantity'])) for row in rows])
+    sold[:] = [(None, sales_snapshot_of(row['order_id'], row['product_id'], row['quantity'], row['unit_price']))
+               for row in rows]
+    record_sales_changes(sold)
+    return [created(index, id) for (index, _), id in zip(chunk, ids)]
+
+@flask_app.route('/order-items/bulk', methods=['POST'])
+@token_required
+def bulk_create_order_items():
+    sold = []
+    return jsonify(run_bulk(OrderItem, lambda chunk: create_order_item_chunk(chunk, sold),
+                            after_commit=lambda results: record_sold(sold)))
+
 @flask_app.route('/order-items', methods=['GET'])
 def read_all_order_items():
-    order_items = OrderItem.query.all()
-    return jsonify([order_item.to_dict() for order_item in order_items])
+    order_items, serialize = projected(OrderItem.query, OrderItem)
+    return paginate(order_items, OrderItem.id, serialize)
 
 @flask_app.route('/order-items/item', methods=['GET'])
 def read_order_item():
@@ -238,10 +447,18 @@ def read_order_item():
 def update_order_item():
     id = request.args.get('item')
     order_item = OrderItem.query.get_or_404(id)
+    before = item_snapshot(order_item)
+    sales_before = sales_snapshot(order_item)
     data = request.get_json()
+    if 'product_id' in data and 'unit_price' not in data:
+        data = price_items([dict(data)])[0]
     for key,value in data.items():
         setattr(order_item,key,value)
+    record_item_change(before, item_snapshot(order_item))
+    sales_after = sales_snapshot(order_item)
+    record_sales_change(sales_before, sales_after)
     db.session.commit()
+    record_sold([(sales_before, sales_after)])
     return jsonify(order_item.to_dict())
 
 @flask_app.route('/order-items/item', methods=['DELETE'])
@@ -249,9 +466,13 @@ def update_order_item():
 def delete_order_item():
     id = request.args.get('item')
     order_item = OrderItem.query.get_or_404(id)
+    record_item_change(before=item_snapshot(order_item))
+    sales_before = sales_snapshot(order_item)
     db.session.delete(order_item)
+    record_sales_change(before=sales_before)
     db.session.commit()
-    return jsonify({"Element deleted sucessfully"})
+    record_sold([(sales_before, None)])
+    return jsonify({'message': 'Element deleted sucessfully'})
 
 @flask_app.route('/cart', methods=['POST'])
 @token_required
@@ -264,14 +485,91 @@ def create_cart():
 
 @flask_app.route('/cart', methods=['GET'])
 def read_all_carts():
-    carts = Cart.query.all()
-    return jsonify({[cart.to_dict() for cart in carts]})
+    carts, serialize = list_query(Cart.query, Cart)
+    return paginate(carts, Cart.id, serialize)
 
 @flask_app.route('/cart/id', methods=['GET'])
 def read_cart():
     id = request.args.get('id')
-    cart = Cart.query.get_or_404(id)
-    return jsonify(cart.to_dict())
+    carts, serialize = with_includes(Cart.query, Cart)
+    cart = carts.filter(Cart.id == id).first_or_404()
+    return jsonify(serialize(cart))
+
+#a cart with its items, product snapshots, line totals and cart total, read with one query and
+#cached per cart. The entry keeps the table_versions of the cart ('cart:<id>', bumped by cart
+#and cart item writes) and of each of its products ('product:<id>', bumped by product and
+#stock writes) as read before the summary was; a read checks them with one query and reloads
+#when one has moved. The versions are bumped in the write's transaction, so writes made by
+#other workers are seen too, and a write to one product only drops the carts holding it.
+
+def cart_summary_key(cart_id):
+    return 'cart-summary:%s' % cart_id
+
+def bump_carts(*cart_ids):
+    bump_version(*row_versions('cart', sorted({int(cart_id) for cart_id in cart_ids})))
+
+def cart_summary_versions(cart_id, product_ids):
+    names = row_versions('cart', [cart_id]) + row_versions('product', sorted(product_ids))
+    return dict(zip(names, current_versions(*names)))
+
+def load_cart_summary(cart_id):
+    rows = db.session.query(Cart.customer_id, CartItem.id, CartItem.quantity,
+                            Product.id, Product.name, Product.price, Product.image, Product.quantity)\
+        .select_from(Cart)\
+        .outerjoin(CartItem, CartItem.cart_id == Cart.id)\
+        .outerjoin(Product, CartItem.product_id == Product.id)\
+        .filter(Cart.id == cart_id)\
+        .order_by(CartItem.id)\
+        .all()
+    if not rows:
+        return None
+    items = []
+    total = Decimal(0)
+    for customer_id, item_id, quantity, product_id, name, price, image, stock in rows:
+        if item_id is None or product_id is None:
+            continue
+        line_total = price * quantity
+        total += line_total
+        items.append({
+            'id': item_id,
+            'product_id': product_id,
+            'quantity': quantity,
+            'unit_price': float(price),
+            'line_total': float(line_total),
+            'product': {'id': product_id, 'name': name, 'price': float(price), 'image': image, 'quantity': stock}
+        })
+    return {'id': int(cart_id), 'customer_id': rows[0][0], 'items': items, 'item_count': len(items),
+            'total_quantity': sum(item['quantity'] for item in items), 'total': float(total)}
+
+#returns {'summary': ..., 'versions': {name: version}}; an item added after the versions were
+#read also bumped the cart's version, so the next read reloads
+
+def load_cart_summary_entry(cart_id):
+    versions = cart_summary_versions(cart_id, {row[0] for row in db.session.query(CartItem.product_id)
+                                               .filter(CartItem.cart_id == cart_id)})
+    summary = load_cart_summary(cart_id)
+    if summary is None:
+        return None
+    return {'summary': summary, 'versions': versions}
+
+def cart_summary(cart_id):
+    key = cart_summary_key(cart_id)
+    entry = cache.get_or_load(key, lambda: load_cart_summary_entry(cart_id))
+    if entry is not None and list(entry['versions'].values()) != current_versions(*entry['versions']):
+        cache.invalidate(key)
+        entry = cache.get_or_load(key, lambda: load_cart_summary_entry(cart_id))
+    return entry['summary'] if entry is not None else None
+
+@flask_app.route('/cart/summary', methods=['GET'])
+@token_required
+def read_cart_summary():
+    id = int_arg('id')
+    if id is None:
+        return jsonify({'error': 'id is required'}), 400
+    summary = cart_summary(id)
+    if summary is None:
+        return jsonify({'error': 'Cart not found'}), 404
+    return jsonify(summary)
 
 @flask_app.route('/cart/id', methods=['PUT'])
 @token_required
@@ -281,6 +579,7 @@ def update_cart():
     data = request.get_json()
     for key,value in data.items():
         setattr(cart,key,value)
+    bump_carts(id)
     db.session.commit()
     return jsonify(cart.to_dict())
 
@@ -290,8 +589,65 @@ def delete_cart():
     id = request.args.get('id')
     cart = Cart.query.get_or_404(id)
     db.session.delete(cart)
+    bump_carts(id)
     db.session.commit()
-    return jsonify({"Element deleted sucessfully"})
+    return jsonify({'message': 'Element deleted sucessfully'})
+
+#converts a cart into an order in one transaction: the cart's pending reservations are
+#committed and the rest of the stock is taken with guarded updates (quantity >= wanted) from
+#the product or its shards, so a checkout either takes all of its stock or nothing. The cart
+#row is locked and its items are deleted before any stock is taken; if the delete does not
+#remove exactly the items that were read, another checkout (or edit) of the cart got there
+#first and this one is rolled back, so a double submit can't create two orders.
+
+@flask_app.route('/cart/checkout', methods=['POST'])
+@token_required
+def checkout_cart():
+    id = request.args.get('id')
+    cart = Cart.query.filter(Cart.id == id).with_for_update().first_or_404()
+    lines = db.session.query(CartItem.product_id, Product.category_id, func.sum(CartItem.quantity), Product.price,
+                             func.count(CartItem.id))\
+        .join(Product, CartItem.product_id == Product.id)\
+        .filter(CartItem.cart_id == cart.id)\
+        .group_by(CartItem.product_id, Product.category_id, Product.price)\
+        .order_by(CartItem.product_id)\
+        .all()
+    if not lines:
+        return jsonify({'error': 'Cart is empty'}), 400
+    deleted = db.session.execute(delete(CartItem).where(CartItem.cart_id == cart.id)).rowcount
+    if deleted != sum(line[4] for line in lines):
+        db.session.rollback()
+        return jsonify({'error': 'Cart changed during checkout'}), 409
+
+    wanted, released = settle_cart_reservations(cart.id, [(line[0], int(line[2])) for line in lines])
+    if not take_stock(wanted):
+        db.session.rollback()
+        stock = available_stock([line[0] for line in lines])
+        reserved = dict(db.session.query(Reservation.product_id, func.sum(Reservation.quantity))
+                        .filter(Reservation.cart_id == cart.id, Reservation.status == 'pending')
+                        .group_by(Reservation.product_id))
+        available = {line[0]: stock.get(line[0], 0) + int(reserved.get(line[0], 0)) for line in lines}
+        missing = [{'product_id': line[0], 'requested': int(line[2]), 'available': available[line[0]]}
+                   for line in lines if available[line[0]] < line[2]]
+        return jsonify({'error': 'Insufficient stock', 'products': missing}), 409
+
+    order = Order(customer_id=cart.customer_id, order_date=datetime.datetime.now())
+    order.item_count = len(lines)
+    order.total_amount = sum(line[3] * int(line[2]) for line in lines)
+    db.session.add(order)
+    db.session.flush()
+    items = [{'order_id': order.id, 'product_id': line[0], 'quantity': int(line[2]), 'unit_price': line[3]} for line in lines]
+    db.session.execute(insert(OrderItem), items)
+    sold = [(None, sales_snapshot_of(order.id, item['product_id'], item['quantity'], item['unit_price'])) for item in items]
+    record_sales_changes(sold)
+    bump_carts(cart.id)
+    db.session.commit()
+
+    invalidate_products({line[0] for line in lines} | released)
+    record_sold(sold)
+    result = order.to_dict()
+    result['items'] = [{'product_id': item['product_id'], 'quantity': item['quantity']} for item in items]
+    return jsonify(result), 201
 
 @flask_app.route('/cart-items', methods=['POST'])
 @token_required
@@ -299,13 +655,26 @@ def create_cart_item():
     data = request.get_json()
     cart_item = CartItem(**data)
     db.session.add(cart_item)
+    bump_carts(cart_item.cart_id)
     db.session.commit()
     return jsonify(cart_item.to_dict())
 
+@flask_app.route('/cart-items/bulk', methods=['POST'])
+@token_required
+def bulk_create_cart_items():
+    write = create_chunk(CartItem)
+
+    def write_chunk(chunk):
+        results = write(chunk)
+        bump_carts(*[item['cart_id'] for _, item in chunk])
+        return results
+
+    return jsonify(run_bulk(CartItem, write_chunk))
+
 @flask_app.route('/cart-items', methods=['GET'])
 def read_all_cart_items():
-    cart_items = CartItem.query.all()
-    return jsonify({[cart_item.to_dict() for cart_item in cart_items]})
+    cart_items, serialize = projected(CartItem.query, CartItem)
+    return paginate(cart_items, CartItem.id, serialize)
 
 @flask_app.route('/cart-items/item', methods=['GET'])
 def read_cart_item():
@@ -318,9 +687,11 @@ def read_cart_item():
 def update_cart_item():
     id = request.args.get('item')
     cart_item = CartItem.query.get_or_404(id)
+    old_cart_id = cart_item.cart_id
     data = request.get_json()
     for key, value in data.items():
         setattr(cart_item,key, value)
+    bump_carts(old_cart_id, cart_item.cart_id)
     db.session.commit()
     return jsonify(cart_item.to_dict())
 
@@ -329,49 +700,120 @@ def update_cart_item():
 def delete_cart_item():
     id = request.args.get('item')
     cart_item = CartItem.query.get_or_404(id)
+    cart_id = cart_item.cart_id
     db.session.delete(cart_item)
+    bump_carts(cart_id)
     db.session.commit()
-    return jsonify({"Element removed sucessfully"})        
+    return jsonify({'message': 'Element removed sucessfully'})        
     
+#stock reservations: reserve takes stock for a limited time, commit keeps it, release returns it
+
+@flask_app.route('/reservations', methods=['POST'])
+@token_required
+def create_reservation():
+    data = request.get_json()
+    product_id = data.get('product_id')
+    quantity = data.get('quantity')
+    if not isinstance(product_id, int) or not isinstance(quantity, int) or quantity < 1:
+        return jsonify({'error': 'product_id and a positive quantity are required'}), 400
+    ttl = data.get('ttl')
+    ttl = datetime.timedelta(seconds=ttl) if isinstance(ttl, int) and ttl > 0 else None
+    Product.query.get_or_404(product_id)
+    reservation = reserve(product_id, quantity, cart_id=data.get('cart_id'), ttl=ttl)
+    if reservation is None:
+        db.session.rollback()
+        return jsonify({'error': 'Insufficient stock'}), 409
+    db.session.commit()
+    invalidate_products([product_id])
+    return jsonify(reservation.to_dict()), 201
+
+@flask_app.route('/reservations/reservation', methods=['GET'])
+def read_reservation():
+    id = request.args.get('id')
+    reservation = Reservation.query.get_or_404(id)
+    return jsonify(reservation.to_dict())
+
+@flask_app.route('/reservations/commit', methods=['POST'])
+@token_required
+def commit_reservation_route():
+    id = request.args.get('id')
+    reservation = Reservation.query.get_or_404(id)
+    if not commit_reservation(reservation.id):
+        return jsonify({'error': 'Reservation is not pending'}), 409
+    db.session.commit()
+    return jsonify({'message': 'Reservation committed'})
+
+@flask_app.route('/reservations/release', methods=['POST'])
+@token_required
+def release_reservation_route():
+    id = request.args.get('id')
+    reservation = Reservation.query.get_or_404(id)
+    if release_reservation(reservation.id) is None:
+        return jsonify({'error': 'Reservation is not pending'}), 409
+    db.session.commit()
+    invalidate_products([reservation.product_id])
+    return jsonify({'message': 'Reservation released'})
+
 #Complex queries
 
 #returns catergory and product 
 
 @flask_app.route('/categories-with-products',methods=['GET'])
+@conditional('categories', 'products')
 def get_categories_with_products():
-    categories = Category.query \
-        .join(Product, Category.id == Product.category_id) \
-        .add_columns(Category.id, Category.name, Product.id, Product.name, Product.description, Product.price, Product.image, Product.quantity) \
-        .all()
-    serialized_categories = []
+    limit, after = page_args()
+    products_limit = int_arg('products_limit', minimum=1)
+
+    categories = db.session.query(Category.id, Category.name)\
+        .filter(Category.products.any())
+    if after is not None:
+        categories = categories.filter(Category.id > after)
+    categories = categories.order_by(Category.id).limit(limit).all()
+
+    serialized_categories = {}
     for category in categories:
-        category_data = {
-            "id": category[1],
-            "name": category[2],
+        serialized_categories[category[0]] = {
+            "id": category[0],
+            "name": category[1],
             "products": []
         }
-        product_data = {
-            "id": category[3],
-            "name": category[4],
-            "description": category[5],
-            "price": str(category[6]),
-            "image": category[7],
-            "quantity": category[8]
-        }
-        if category_data in serialized_categories:
-            category_index = serialized_categories.index(category_data)
-            serialized_categories[category_index]["products"].append(product_data)
-        else:
-            category_data["products"].append(product_data)
-            serialized_categories.append(category_data)
-    return jsonify(serialized_categories)
 
-#returns average price per category
+    products = db.session.query(Product.category_id, Product.id, Product.name, Product.description,
+                                Product.price, Product.image, Product.quantity)\
+        .filter(Product.category_id.in_(list(serialized_categories)))
+    if products_limit:
+        rank = func.row_number().over(partition_by=Product.category_id, order_by=Product.id)
+        ranked = products.add_columns(rank.label('rank')).subquery()
+        products = db.session.query(ranked.c.category_id, ranked.c.id, ranked.c.name, ranked.c.description,
+                                    ranked.c.price, ranked.c.image, ranked.c.quantity)\
+            .filter(ranked.c.rank <= products_limit)\
+            .order_by(ranked.c.category_id, ranked.c.id)
+    else:
+        products = products.order_by(Product.category_id, Product.id)
+
+    if serialized_categories:
+        for product in products:
+            serialized_categories[product[0]]["products"].append({
+                "id": product[1],
+                "name": product[2],
+                "description": product[3],
+                "price": str(product[4]),
+                "image": product[5],
+                "quantity": product[6]
+            })
+
+    response = jsonify(list(serialized_categories.values()))
+    if len(categories) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(categories[-1][0])
+    return response
+
+#returns average price per category, read from the category_stats table
 
 @flask_app.route('/avg_price_by_category', methods=['GET'])
 def get_avg_price_by_category():
-    results = db.session.query(Category.name, func.avg(Product.price))\
-        .join(Product, Category.id == Product.category_id)\
+    results = db.session.query(Category.name, func.sum(CategoryStats.price_sum) / func.sum(CategoryStats.product_count))\
+        .join(CategoryStats, Category.id == CategoryStats.category_id)\
+        .filter(CategoryStats.product_count > 0)\
         .group_by(Category.name)\
         .all()
     serialized_results = [{
@@ -380,12 +822,13 @@ def get_avg_price_by_category():
     } for result in results]
     return jsonify(serialized_results)
 
-#returns quantity of products per category
+#returns quantity of products per category, read from the category_stats table
 
 @flask_app.route('/products_quantity_per_category', methods=['GET'])
 def get_quantity_per_category():
-    results = db.session.query(Category.name, func.count(Product.id))\
-        .join(Product, Category.id == Product.category_id)\
+    results = db.session.query(Category.name, func.sum(CategoryStats.product_count))\
+        .join(CategoryStats, Category.id == CategoryStats.category_id)\
+        .filter(CategoryStats.product_count > 0)\
         .group_by(Category.name)\
         .all()
     serialized_results = [{
@@ -397,9 +840,9 @@ def get_quantity_per_category():
 @flask_app.route('/products_quantity_per_category/category', methods=['GET'])
 def get_quantity_per_specific_category():
     cat = request.args.get('category')
-    results = db.session.query(Category.name, func.count(Product.id))\
-        .join(Product, Category.id == Product.category_id)\
-        .filter(Category.name == cat)\
+    results = db.session.query(Category.name, func.sum(CategoryStats.product_count))\
+        .join(CategoryStats, Category.id == CategoryStats.category_id)\
+        .filter(Category.name == cat, CategoryStats.product_count > 0)\
         .group_by(Category.name)\
         .all()
     serialized_results = [{
@@ -408,47 +851,59 @@ def get_quantity_per_specific_category():
     } for result in results]
     return jsonify(serialized_results)
 
-#returns customers and their orders
+#returns customers and their orders, grouped per customer; ?from=/?to= filter on order_date
+
+def order_date_window():
+    window = []
+    date_from = datetime_arg('from')
+    date_to = datetime_arg('to')
+    if date_from is not None:
+        window.append(Order.order_date >= date_from)
+    if date_to is not None:
+        window.append(Order.order_date < date_to)
+    return window
+
+def stream_orders_per_customer(customer_ids, window):
+    if not customer_ids:
+        return stream_json([])
+    elements = stream_query(db.session.query(Customer.id, Customer.name, Order.id, Order.order_date)
+                            .join(Order, Order.customer_id == Customer.id)
+                            .filter(Customer.id.in_(customer_ids), *window)
+                            .order_by(Customer.id, Order.id))
+
+    def group():
+        for customer, orders in groupby(elements, key=lambda element: (element[0], element[1])):
+            yield {
+                'id':customer[0],
+                'name':customer[1],
+                'orders':[{
+                    'id':element[2],
+                    'order_date':str(element[3])
+                } for element in orders]
+            }
+
+    return stream_json(group())
 
 @flask_app.route('/orders-per-customers', methods=['GET'])
-def get_orders_for_all_customers():    
-    elements = db.session.query(Customer.id, Customer.name, Order.id, Order.order_date)\
-        .join(Order, Order.customer_id == Customer.id).all()
-    
-    result = []
-    for element in elements:
-        customer_dict = {
-            'id':element[0],
-            'name':element[1],
-            'orders':[{
-                'id':element[2],
-                'order_date':str(element[3])
-            }]
-        }
-        result.append(customer_dict)
-        
-    return jsonify(result)
+def get_orders_for_all_customers():
+    limit, after = page_args()
+    window = order_date_window()
+    customers = db.session.query(Customer.id).filter(Customer.orders.any(and_(true(), *window)))
+    if after is not None:
+        customers = customers.filter(Customer.id > after)
+    customer_ids = [customer[0] for customer in customers.order_by(Customer.id).limit(limit)]
+
+    response = stream_orders_per_customer(customer_ids, window)
+    if len(customer_ids) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(customer_ids[-1])
+    return response
 
 @flask_app.route('/orders-per-customers/customer', methods=['GET'])
 def get_orders_for_customer():
-    id = request.args.get('id')    
-    elements = db.session.query(Customer.id, Customer.name, Order.id, Order.order_date)\
-        .filter(Customer.id == id)\
-        .join(Order, Order.customer_id == Customer.id).all()
-    
-    result = []
-    for element in elements:
-        customer_dict = {
-            'id':element[0],
-            'name':element[1],
-            'orders':[{
-                'id':element[2],
-                'order_date':str(element[3])
-            }]
-        }
-        result.append(customer_dict)
-        
-    return jsonify(result)
+    id = int_arg('id')
+    if id is None:
+        return jsonify({'error': 'id is required'}), 400
+    return stream_orders_per_customer([id], order_date_window())
 
 #returns order details of customers
 
@@ -530,15 +985,55 @@ def get_num_of_orders_of__customer():
 
     return jsonify(result)
 
-#returns total price of an order
+#revenue over time from the daily sales rollups: ?from=&to= (dates, inclusive),
+#?granularity=day|week|month and optionally ?category=<id>
+
+@flask_app.route('/reports/sales', methods=['GET'])
+def get_sales_report():
+    start = datetime_arg('from')
+    end = datetime_arg('to')
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        return jsonify({'error': 'granularity must be one of: %s' % ', '.join(GRANULARITIES)}), 400
+    category_id = int_arg('category')
+    return jsonify(sales_report(start.date() if start else None, end.date() if end else None, granularity, category_id))
+
+#streams the order item / order / customer / product join as CSV, NDJSON, Arrow or Parquet.
+#?since_id= or ?since_date= take the watermark of the previous export (sent back in
+#X-Export-Watermark), so incremental pulls only read new rows
+
+EXPORT_WATERMARK_HEADER = 'X-Export-Watermark'
+
+@flask_app.route('/export/order-items', methods=['GET'])
+@token_required
+def export_order_items():
+    format = request.args.get('format', 'csv')
+    error = check_format(format)
+    if error:
+        return jsonify({'error': error}), 400
+    since_date = datetime_arg('since_date')
+    key = request.args.get('watermark', 'order_date' if since_date is not None else 'id')
+    if key not in WATERMARKS:
+        return jsonify({'error': 'watermark must be one of: %s' % ', '.join(WATERMARKS)}), 400
+    since = since_date if key == 'order_date' else int_arg('since_id', minimum=0)
+
+    watermark, body = export(format, key, since)
+    _, mimetype, extension, _ = FORMATS[format]
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers[EXPORT_WATERMARK_HEADER] = format_watermark(key, watermark)
+    response.headers['Content-Disposition'] = 'attachment; filename=order-items.%s' % extension
+    return response
+
+#returns total price of an order, read from the totals stored on each order
+
+def stored_totals(column):
+    return db.session.query(Customer.id, Customer.name, Order.id, column)\
+        .join(Customer, Order.customer_id == Customer.id)\
+            .filter(Order.item_count > 0)
 
 @flask_app.route('/total-price-of-order', methods=['GET'])
 def get_total_price():
-    customers = db.session.query(Customer.id, Customer.name, Order.id, func.sum(Product.price))\
-        .join(Order, Customer.id == Order.customer_id)\
-            .join(OrderItem, Order.id == OrderItem.order_id)\
-                .join(Product, OrderItem.product_id == Product.id)\
-                    .group_by(Customer.id, Customer.name, Order.id)
+    customers = stored_totals(Order.total_amount).order_by(Order.id)
     
     result = []
     
@@ -555,12 +1050,7 @@ def get_total_price():
 @flask_app.route('/total-price-of-order/order', methods=['GET'])
 def get_total_price_of_order():
     id = request.args.get('id')
-    customers = db.session.query(Customer.id, Customer.name, Order.id, func.sum(Product.price))\
-        .filter(Order.id == id)\
-        .join(Order, Customer.id == Order.customer_id)\
-            .join(OrderItem, Order.id == OrderItem.order_id)\
-                .join(Product, OrderItem.product_id == Product.id)\
-                    .group_by(Customer.id, Customer.name, Order.id)
+    customers = stored_totals(Order.total_amount).filter(Order.id == id)
     
     result = []
     
@@ -578,11 +1068,7 @@ def get_total_price_of_order():
 
 @flask_app.route('/total-count-of-order', methods=['GET'])
 def get_total_count():
-    customers = db.session.query(Customer.id, Customer.name, Order.id,func.count(Product.price))\
-        .join(Order, Customer.id == Order.customer_id)\
-            .join(OrderItem, Order.id == OrderItem.order_id)\
-                .join(Product, OrderItem.product_id == Product.id)\
-                    .group_by(Customer.id, Customer.name, Order.id)
+    customers = stored_totals(Order.item_count).order_by(Order.id)
     
     result = []
     
@@ -599,12 +1085,7 @@ def get_total_count():
 @flask_app.route('/total-count-of-order/order', methods=['GET'])
 def get_total_count_of_products():
     id = request.args.get('id')
-    customers = db.session.query(Customer.id, Customer.name, Order.id,func.count(Product.price))\
-        .filter(Order.id == id)\
-        .join(Order, Customer.id == Order.customer_id)\
-            .join(OrderItem, Order.id == OrderItem.order_id)\
-                .join(Product, OrderItem.product_id == Product.id)\
-                    .group_by(Customer.id, Customer.name, Order.id)
+    customers = stored_totals(Order.item_count).filter(Order.id == id)
     
     result = []
     
@@ -618,6 +1099,34 @@ def get_total_count_of_products():
         
     return jsonify(result)
 
+#top sellers by units from the in-process heavy-hitter summaries: ?scope=overall|category|24h,
+#?category=<id> for the category scope, ?limit= (default 50). Counts may be over-estimated by
+#at most `error` units between reconciliations.
+
+@flask_app.route('/products/best-sellers', methods=['GET'])
+def get_best_sellers():
+    scope = request.args.get('scope', 'overall')
+    if scope not in BEST_SELLER_SCOPES:
+        return jsonify({'error': 'scope must be one of: %s' % ', '.join(BEST_SELLER_SCOPES)}), 400
+    category_id = int_arg('category')
+    if scope == 'category' and category_id is None:
+        return jsonify({'error': 'category is required for the category scope'}), 400
+    limit = min(int_arg('limit', 50, minimum=1), best_sellers.capacity())
+    return jsonify([{'product_id': product_id, 'units': units, 'error': error}
+                    for product_id, units, error in best_sellers.top(scope, limit, category_id)])
+
+#products most often bought in the same order as ?product=, from the in-process co-occurrence
+#counts; ?limit= (default 10) is capped at RECOMMENDATIONS_TOP_K
+
+@flask_app.route('/products/recommendations', methods=['GET'])
+def get_recommendations():
+    product_id = int_arg('product')
+    if product_id is None:
+        return jsonify({'error': 'product is required'}), 400
+    limit = min(int_arg('limit', 10, minimum=1), recommendations.k())
+    return jsonify([{'product_id': other, 'orders': orders}
+                    for other, orders in recommendations.recommend(product_id, limit)])
+
 #returns total amount of products of all orders
 
 @flask_app.route('/total-products-per-order/product', methods=['GET'])
@@ -639,18 +1148,32 @@ def total_products_per_specific_order():
         
     return jsonify(result)                
 
+#returns products in a price band ordered by price, optionally within one category
+
 @flask_app.route('/products/cost', methods=['GET'])
 def get_products_in_range():
-    min_cost = float(request.args.get('min_cost'))
-    max_cost = float(request.args.get('max_cost'))
-    
-    products = Product.query.filter(Product.price >= min_cost, Product.price <= max_cost).all()
-    
-    return jsonify([product.to_dict() for product in products])
+    try:
+        min_cost = Decimal(request.args.get('min_cost'))
+        max_cost = Decimal(request.args.get('max_cost'))
+    except (TypeError, InvalidOperation):
+        return jsonify({'error': 'min_cost and max_cost are required numbers'}), 400
+    category = int_arg('category')
+
+    products = Product.query.filter(Product.price >= min_cost, Product.price <= max_cost)
+    if category is not None:
+        products = products.filter(Product.category_id == category)
+    products, serialize = projected(products, Product, Product.price)
+    return paginate_range(products, Product.price, Product.id, Decimal, serialize)
+
+#returns products with at least `stock` units ordered by quantity, optionally within one category
 
 @flask_app.route('/products/stock', methods=['GET'])
 def get_products_stock():
-    stock_count = request.args.get('stock')
+    stock_count = int_arg('stock', 0)
+    category = int_arg('category')
+
     products = Product.query.filter(Product.quantity >= stock_count)
-    
-    return jsonify([product.to_dict() for product in products])
\ No newline at end of file
+    if category is not None:
+        products = products.filter(Product.category_id == category)
+    products, serialize = projected(products, Product, Product.quantity)
+    return paginate_range(products, Product.quantity, Product.id, int, serialize)
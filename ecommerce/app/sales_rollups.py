@@ -0,0 +1,135 @@
+import datetime
+from decimal import Decimal
+
+from sqlalchemy import delete, func, insert, select
+
+from app import db
+from app.counters import add_to_rows
+from app.models import Order, OrderItem, Product, SalesRollup
+
+#sales_rollups holds, per day (of Order.order_date) and product category, the number of
+#orders with items in that category, the units sold and the revenue (unit_price * quantity).
+#Order item writes record their before/after snapshots in the same session as the write; an
+#order's count only moves when its first item in a category arrives or its last one goes.
+#Items are attributed to their product's category at write time; rebuild_sales_rollups
+#re-attributes everything to the current categories.
+
+GRANULARITIES = ('day', 'week', 'month')
+
+def snapshot_of(order_id, product_id, quantity, unit_price):
+    return (int(order_id), int(product_id), int(quantity), Decimal(str(unit_price or 0)))
+
+def snapshot(item):
+    return snapshot_of(item.order_id, item.product_id, item.quantity, item.unit_price)
+
+#deltas is {(day, category_id): (orders, units, revenue)}
+
+def apply_deltas(deltas):
+    add_to_rows(SalesRollup, ('bucket_date', 'category_id'), ('order_count', 'units', 'revenue'), deltas)
+
+def record_sales_changes(changes):
+    changes = [(before, after) for before, after in changes if before is not None or after is not None]
+    if not changes:
+        return
+    db.session.flush()
+    snapshots = [item for change in changes for item in change if item is not None]
+    categories = dict(db.session.query(Product.id, Product.category_id)
+                      .filter(Product.id.in_({item[1] for item in snapshots})))
+    days = {id: order_date.date() for id, order_date in db.session.query(Order.id, Order.order_date)
+            .filter(Order.id.in_({item[0] for item in snapshots}))}
+
+    deltas = {}
+    lines = {}
+    for before, after in changes:
+        for item, sign in ((before, -1), (after, 1)):
+            if item is None:
+                continue
+            order_id, product_id, quantity, unit_price = item
+            category_id = categories.get(product_id)
+            day = days.get(order_id)
+            if category_id is None or day is None:
+                continue
+            lines[(order_id, category_id)] = lines.get((order_id, category_id), 0) + sign
+            delta = deltas.setdefault((day, category_id), [0, 0, Decimal(0)])
+            delta[1] += sign * quantity
+            delta[2] += sign * quantity * unit_price
+
+    #net line changes per (order, category) against the lines it has now tell whether the
+    #order went from none to some items in the category or back
+    changed = {key: net for key, net in lines.items() if net}
+    if changed:
+        current = {(order_id, category_id): count for order_id, category_id, count in
+                   db.session.query(OrderItem.order_id, Product.category_id, func.count(OrderItem.id))
+                   .join(Product, OrderItem.product_id == Product.id)
+                   .filter(OrderItem.order_id.in_({order_id for order_id, _ in changed}))
+                   .group_by(OrderItem.order_id, Product.category_id)}
+        for (order_id, category_id), net in changed.items():
+            now = current.get((order_id, category_id), 0)
+            orders = (now > 0) - (now - net > 0)
+            if orders:
+                deltas.setdefault((days[order_id], category_id), [0, 0, Decimal(0)])[0] += orders
+
+    apply_deltas(deltas)
+
+def record_sales_change(before=None, after=None):
+    record_sales_changes([(before, after)])
+
+#moves an order's contribution when its order_date changes day
+
+def move_order(order_id, old_date, new_date):
+    if old_date.date() == new_date.date():
+        return
+    rows = db.session.query(Product.category_id, func.sum(OrderItem.quantity),
+                            func.sum(OrderItem.unit_price * OrderItem.quantity))\
+        .join(Product, OrderItem.product_id == Product.id)\
+        .filter(OrderItem.order_id == order_id)\
+        .group_by(Product.category_id)
+    deltas = {}
+    for category_id, units, revenue in rows:
+        revenue = Decimal(str(revenue or 0))
+        deltas[(old_date.date(), category_id)] = (-1, -units, -revenue)
+        deltas[(new_date.date(), category_id)] = (1, units, revenue)
+    apply_deltas(deltas)
+
+def rebuild_sales_rollups(connection):
+    day = func.date(Order.order_date)
+    connection.execute(delete(SalesRollup))
+    connection.execute(insert(SalesRollup).from_select(
+        ['bucket_date', 'category_id', 'order_count', 'units', 'revenue'],
+        select(day, Product.category_id, func.count(func.distinct(Order.id)), func.sum(OrderItem.quantity),
+               func.coalesce(func.sum(OrderItem.unit_price * OrderItem.quantity), 0))
+        .join(Order, OrderItem.order_id == Order.id)
+        .join(Product, OrderItem.product_id == Product.id)
+        .group_by(day, Product.category_id)))
+
+#reporting: daily buckets are merged into weeks (starting Monday) or months in Python, so a
+#range costs one indexed read of (days x categories) rows however many items it covers
+
+def period_start(day, granularity):
+    if granularity == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+def sales_report(start=None, end=None, granularity='day', category_id=None):
+    query = db.session.query(SalesRollup.bucket_date, SalesRollup.category_id, SalesRollup.order_count,
+                             SalesRollup.units, SalesRollup.revenue)
+    if start is not None:
+        query = query.filter(SalesRollup.bucket_date >= start)
+    if end is not None:
+        query = query.filter(SalesRollup.bucket_date <= end)
+    if category_id is not None:
+        query = query.filter(SalesRollup.category_id == category_id)
+
+    periods = {}
+    for day, category, orders, units, revenue in query.order_by(SalesRollup.bucket_date, SalesRollup.category_id):
+        if not (orders or units):
+            continue
+        totals = periods.setdefault((period_start(day, granularity), category), [0, 0, Decimal(0)])
+        totals[0] += orders
+        totals[1] += units
+        totals[2] += revenue
+    return [{'period': period.isoformat(), 'category_id': category, 'order_count': orders, 'units': units,
+             'revenue': float(revenue)}
+            for (period, category), (orders, units, revenue) in sorted(periods.items())]
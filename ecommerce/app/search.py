@@ -0,0 +1,171 @@
+import heapq
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+
+from app import flask_app, db
+from app.models import Product
+from app.versioning import current_versions
+
+#In-process inverted index over product name and description, ranked with BM25 (name terms
+#count NAME_WEIGHT times). The product write routes reindex the rows they touched right after
+#commit. Writes made by other processes are noticed through the 'product_search' table version;
+#when it moves on, the index is rebuilt in the background at most every SEARCH_MAX_STALENESS
+#seconds while searches keep using the old one.
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset(('a', 'an', 'and', 'for', 'in', 'of', 'on', 'or', 'the', 'to', 'with'))
+NAME_WEIGHT = 3
+K1 = 1.2
+B = 0.75
+VERSION_KEY = 'product_search'
+BUILD_CHUNK_SIZE = 5000
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall((text or '').lower()) if token not in STOPWORDS]
+
+class ProductSearchIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.rebuilding = False
+        self.version = None
+        self.checked_at = 0.0
+        self.reset()
+
+    def reset(self):
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.total_length = 0
+
+    def add(self, product_id, name, description, category_id):
+        frequencies = defaultdict(int)
+        for token in tokenize(name):
+            frequencies[token] += NAME_WEIGHT
+        for token in tokenize(description):
+            frequencies[token] += 1
+        length = sum(frequencies.values())
+        with self.lock:
+            self.remove(product_id)
+            for token, frequency in frequencies.items():
+                self.postings[token][product_id] = frequency
+            self.documents[product_id] = (category_id, length, tuple(frequencies))
+            self.total_length += length
+
+    def remove(self, product_id):
+        with self.lock:
+            document = self.documents.pop(product_id, None)
+            if document is None:
+                return
+            _, length, tokens = document
+            for token in tokens:
+                postings = self.postings.get(token)
+                if postings is not None:
+                    postings.pop(product_id, None)
+                    if not postings:
+                        del self.postings[token]
+            self.total_length -= length
+
+    def load(self, index):
+        rows = db.session.execute(db.select(Product.id, Product.name, Product.description, Product.category_id)
+                                  .execution_options(yield_per=BUILD_CHUNK_SIZE))
+        for row in rows:
+            index.add(*row)
+
+    def build(self):
+        version = current_versions(VERSION_KEY)[0]
+        fresh = ProductSearchIndex()
+        self.load(fresh)
+        with self.lock:
+            self.postings, self.documents, self.total_length = fresh.postings, fresh.documents, fresh.total_length
+            self.version = version
+            self.checked_at = time.monotonic()
+
+    def rebuild_in_background(self):
+        with self.lock:
+            if self.rebuilding:
+                return
+            self.rebuilding = True
+
+        def run():
+            try:
+                with flask_app.app_context():
+                    self.build()
+            finally:
+                self.rebuilding = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    #builds the index on first use and schedules a rebuild when other processes changed products
+
+    def ensure_fresh(self):
+        if self.version is None:
+            with self.lock:
+                if self.version is None:
+                    self.build()
+            return
+        if time.monotonic() - self.checked_at < flask_app.config.get('SEARCH_MAX_STALENESS', 60):
+            return
+        self.checked_at = time.monotonic()
+        if current_versions(VERSION_KEY)[0] != self.version:
+            self.rebuild_in_background()
+
+    #re-reads the given products after a local write; the index stays current if that write
+    #was the only change since it was last synced. A write whose ids aren't all known (None)
+    #can't be applied, so the index is rebuilt instead of being marked current.
+
+    def reindex(self, product_ids):
+        if self.version is None:
+            return
+        product_ids = list(product_ids)
+        if any(product_id is None for product_id in product_ids):
+            self.rebuild_in_background()
+            return
+        rows = db.session.query(Product.id, Product.name, Product.description, Product.category_id)\
+            .filter(Product.id.in_(list(product_ids))).all()
+        found = set()
+        for row in rows:
+            self.add(*row)
+            found.add(row[0])
+        for product_id in set(product_ids) - found:
+            self.remove(product_id)
+        version = current_versions(VERSION_KEY)[0]
+        with self.lock:
+            if version == self.version + 1:
+                self.version = version
+
+    #returns (total matches, [(product_id, score)] for the page, {category_id: matches})
+
+    def search(self, text, category=None, limit=20, offset=0):
+        tokens = list(dict.fromkeys(tokenize(text)))
+        if not tokens:
+            return 0, [], {}
+        with self.lock:
+            postings = [self.postings.get(token) for token in tokens]
+            if not all(postings):
+                return 0, [], {}
+            postings.sort(key=len)
+            matches = [product_id for product_id in postings[0] if all(product_id in other for other in postings[1:])]
+
+            facets = defaultdict(int)
+            for product_id in matches:
+                facets[self.documents[product_id][0]] += 1
+            if category is not None:
+                matches = [product_id for product_id in matches if self.documents[product_id][0] == category]
+
+            count = len(self.documents)
+            average_length = self.total_length / count if count else 1.0
+            weights = [math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)) for postings in postings]
+
+            def score(product_id):
+                length = self.documents[product_id][1]
+                norm = K1 * (1 - B + B * length / average_length)
+                return sum(weight * postings[product_id] * (K1 + 1) / (postings[product_id] + norm)
+                           for weight, postings in zip(weights, postings))
+
+            ranked = heapq.nlargest(offset + limit, ((score(product_id), -product_id) for product_id in matches))
+        page = [(-negative_id, round(value, 4)) for value, negative_id in ranked[offset:offset + limit]]
+        return len(matches), page, dict(facets)
+
+search_index = ProductSearchIndex()
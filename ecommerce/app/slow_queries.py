@@ -0,0 +1,143 @@
+import datetime
+import json
+import logging
+import queue
+import re
+import threading
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from app.explain import explain
+
+#Statements slower than SLOW_QUERY_THRESHOLD_MS are recorded with their normalized SQL,
+#parameters, originating route and EXPLAIN plan. The engine event only times statements and
+#queues the slow ones; a background thread runs EXPLAIN on its own connection (so a streaming
+#cursor is never disturbed and the request doesn't wait for it), then appends the record to
+#the ring buffer and the rotating log file.
+
+MAX_PARAMETERS_LENGTH = 1000
+EXPLAINABLE = ('SELECT', 'WITH')
+
+def normalize(statement):
+    statement = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    statement = re.sub(r'\b\d+(?:\.\d+)?\b', '?', statement)
+    statement = re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(?, ...)', statement)
+    return ' '.join(statement.split())
+
+def describe_parameters(parameters, executemany):
+    if executemany:
+        text = '%d parameter sets, first: %r' % (len(parameters), parameters[0] if parameters else None)
+    else:
+        text = repr(parameters)
+    return text if len(text) <= MAX_PARAMETERS_LENGTH else text[:MAX_PARAMETERS_LENGTH] + '...'
+
+class SlowQueryLog:
+    def __init__(self):
+        self.threshold = None
+        self.records = deque(maxlen=200)
+        self.pending = queue.Queue(maxsize=1000)
+        self.dropped = 0
+        self.engine = None
+        self.explain_plans = True
+        self.logger = logging.getLogger('ecommerce.slow_queries')
+        self.logger.propagate = False
+        self.worker = None
+        self.lock = threading.Lock()
+
+    def configure(self, engine, threshold_ms, buffer_size=200, path=None, max_bytes=10 * 1024 * 1024,
+                  backups=5, explain_plans=True):
+        self.engine = engine
+        self.threshold = threshold_ms / 1000.0
+        self.records = deque(maxlen=buffer_size)
+        self.explain_plans = explain_plans
+        if path:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, delay=True)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.INFO)
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+        self.worker = threading.Thread(target=self.run, name='slow-query-log', daemon=True)
+        self.worker.start()
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context.slow_query_start = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.slow_query_start
+        if elapsed < self.threshold or threading.current_thread() is self.worker:
+            return
+        route = method = None
+        if has_request_context():
+            route = request.url_rule.rule if request.url_rule is not None else request.path
+            method = request.method
+        try:
+            self.pending.put_nowait((datetime.datetime.utcnow(), elapsed, statement, parameters, executemany,
+                                     route, method))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            try:
+                self.write(self.build(*item))
+            except Exception:
+                self.logger.exception('slow query record failed')
+            finally:
+                self.pending.task_done()
+
+    def build(self, at, elapsed, statement, parameters, executemany, route, method):
+        record = {
+            'at': at.isoformat() + 'Z',
+            'duration_ms': round(elapsed * 1000, 3),
+            'statement': normalize(statement),
+            'parameters': describe_parameters(parameters, executemany),
+            'route': route,
+            'method': method,
+            'plan': None
+        }
+        if self.explain_plans and not executemany and statement.lstrip().upper().startswith(EXPLAINABLE):
+            try:
+                with self.engine.connect() as connection:
+                    record['plan'] = explain(connection, statement, parameters)[0]
+            except Exception as e:
+                record['plan_error'] = str(e)
+        return record
+
+    def write(self, record):
+        self.records.append(record)
+        if self.logger.handlers:
+            self.logger.info(json.dumps(record, default=str))
+
+    #waits until every queued statement has been written out
+    def flush(self):
+        self.pending.join()
+
+    def recent(self, limit=None):
+        records = list(self.records)
+        records.reverse()
+        return records[:limit] if limit else records
+
+    def stats(self):
+        return {'threshold_ms': self.threshold * 1000 if self.threshold is not None else None,
+                'buffered': len(self.records), 'pending': self.pending.qsize(), 'dropped': self.dropped}
+
+slow_query_log = SlowQueryLog()
+
+def configure_slow_query_log(app, db):
+    threshold = app.config['SLOW_QUERY_THRESHOLD_MS']
+    if threshold is None:
+        return
+    with app.app_context():
+        slow_query_log.configure(db.engine, float(threshold),
+                                 buffer_size=int(app.config['SLOW_QUERY_BUFFER_SIZE']),
+                                 path=app.config['SLOW_QUERY_LOG'],
+                                 max_bytes=int(app.config['SLOW_QUERY_LOG_MAX_BYTES']),
+                                 backups=int(app.config['SLOW_QUERY_LOG_BACKUPS']),
+                                 explain_plans=bool(app.config['SLOW_QUERY_EXPLAIN']))
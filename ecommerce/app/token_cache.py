@@ -0,0 +1,108 @@
+import datetime
+import hashlib
+import threading
+import time
+
+import jwt
+from sqlalchemy import delete
+
+from app import flask_app, db
+from app.cache import LRUCache, MISSING
+from app.models import RevokedToken
+
+#Bounded LRU of already-verified JWTs keyed by a digest of the secret and the token, so a
+#repeated token skips jwt.decode. Entries expire at the token's own exp. Revoking a token
+#records its digest in the revoked_tokens table, which every process reads, and in this
+#process (outside the LRU, so it can't be evicted) until its exp passes. revocation_checks
+#lets other code veto a token as well. The table and the checks run when a token is first
+#verified and again every TOKEN_REVOCATION_CHECK_SECONDS while it is cached, so a token
+#revoked elsewhere stops working within that time.
+
+ALGORITHMS = ['HS256']
+
+class VerifiedTokenCache:
+    def __init__(self, max_entries=10000):
+        self.entries = LRUCache(max_entries=max_entries)
+        self.revoked = {}
+        self.revocation_checks = []
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def digest(self, token, secret):
+        return hashlib.sha256(('%s\0%s' % (secret, token)).encode('utf-8')).hexdigest()
+
+    def is_revoked(self, digest, payload=None):
+        expires_at = self.revoked.get(digest)
+        if expires_at is not None:
+            if expires_at > time.time():
+                return True
+            self.revoked.pop(digest, None)
+        if payload is None:
+            return False
+        if any(check(payload) for check in self.revocation_checks):
+            return True
+        return db.session.get(RevokedToken, digest) is not None
+
+    def recheck_at(self):
+        return time.time() + flask_app.config.get('TOKEN_REVOCATION_CHECK_SECONDS', 30)
+
+    def reject(self, digest, payload):
+        with self.lock:
+            self.revoked[digest] = payload.get('exp', float('inf'))
+        self.entries.delete(digest)
+        raise jwt.InvalidTokenError('Token has been revoked')
+
+    #returns the token payload or raises jwt.InvalidTokenError
+
+    def verify(self, token, secret):
+        digest = self.digest(token, secret)
+        if self.is_revoked(digest):
+            raise jwt.InvalidTokenError('Token has been revoked')
+        #entries are [payload, time of the next revocation check]
+        entry = self.entries.get(digest)
+        if entry is not MISSING and entry[0].get('exp', float('inf')) > time.time():
+            payload = entry[0]
+            if time.time() >= entry[1]:
+                if self.is_revoked(digest, payload):
+                    self.reject(digest, payload)
+                entry[1] = self.recheck_at()
+            with self.lock:
+                self.hits += 1
+            return payload
+
+        with self.lock:
+            self.misses += 1
+        payload = jwt.decode(token, secret, algorithms=ALGORITHMS)
+        if self.is_revoked(digest, payload):
+            self.reject(digest, payload)
+        if 'exp' in payload:
+            self.entries.set(digest, [payload, self.recheck_at()], ttl=payload['exp'] - time.time())
+        return payload
+
+    #revokes a token in every process; the caller commits
+
+    def revoke(self, token, secret):
+        digest = self.digest(token, secret)
+        try:
+            payload = jwt.decode(token, secret, algorithms=ALGORITHMS)
+        except jwt.InvalidTokenError:
+            return
+        now = time.time()
+        with self.lock:
+            self.revoked = {key: expires_at for key, expires_at in self.revoked.items() if expires_at > now}
+            self.revoked[digest] = payload.get('exp', float('inf'))
+        self.entries.delete(digest)
+        db.session.execute(delete(RevokedToken).where(RevokedToken.expires_at <= datetime.datetime.utcnow()))
+        if db.session.get(RevokedToken, digest) is None:
+            expires_at = datetime.datetime(9999, 12, 31)
+            if 'exp' in payload:
+                expires_at = datetime.datetime.utcfromtimestamp(payload['exp'])
+            db.session.add(RevokedToken(digest, expires_at))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.entries), 'revoked': len(self.revoked)}
+
+token_cache = VerifiedTokenCache(max_entries=flask_app.config.get('TOKEN_CACHE_SIZE', 10000))
@@ -0,0 +1,58 @@
+import hashlib
+from functools import wraps
+
+from flask import g, make_response, request
+
+from app import db
+from app.counters import add_to_rows
+from app.models import TableVersion
+
+#table_versions keeps one change counter per table. Write routes bump it in the same
+#transaction as the write, and read routes derive their ETag from it, so a client
+#that already has the current version gets a 304 without any rows being read.
+#
+#The read cache is only invalidated by writes made in the same process, so the bodies a
+#conditional route caches are keyed on the versions its ETag was computed from
+#(versioned_key): a write from another worker moves the versions and with them the keys.
+#A row can also version a single record ('product:7', 'cart:3', see row_versions).
+
+def bump_version(*tables):
+    add_to_rows(TableVersion, ('name',), ('version',), {(table,): (1,) for table in tables})
+
+def row_versions(table, ids):
+    return ['%s:%s' % (table, id) for id in ids]
+
+def current_versions(*tables):
+    versions = dict(db.session.query(TableVersion.name, TableVersion.version)
+                    .filter(TableVersion.name.in_(tables)))
+    return [versions.get(table, 0) for table in tables]
+
+def make_etag(tables, versions):
+    digest = hashlib.sha1(request.full_path.encode('utf-8')).hexdigest()[:16]
+    return '%s-%s' % ('.'.join('%s%d' % (table, version) for table, version in zip(tables, versions)), digest)
+
+#appends the table versions read by the enclosing conditional route to a cache key
+
+def versioned_key(key):
+    versions = g.get('table_versions')
+    if not versions:
+        return key
+    return '%s@%s' % (key, '.'.join('%s%d' % version for version in versions))
+
+def conditional(*tables):
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            versions = current_versions(*tables)
+            g.table_versions = list(zip(tables, versions))
+            etag = make_etag(tables, versions)
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return decorated
+    return decorator
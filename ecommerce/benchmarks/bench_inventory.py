@@ -0,0 +1,197 @@
+"""Concurrent checkout throughput for one hot product, unsharded vs sharded stock.
+
+Two scenarios per stock layout: reserve + commit_reservation in a loop (reservations/s), and
+full /cart/checkout requests through the test client, where each cart buys 1-3 units and every
+other cart reserves one of them first (checkouts/s, counting the cart setup). The checkout run
+starts with --checkout-stock units so it sells out, then checks that units sold plus units
+left plus units still reserved add up to the starting stock, and exits non-zero if they don't.
+
+By default it runs on a temporary SQLite file; pass --database-url to use another database
+(its tables must exist, see `flask init-db`; the rows the run adds are deleted afterwards).
+From the ecommerce directory:
+
+    python -m benchmarks.bench_inventory --threads 16 --seconds 10 --shards 16
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import delete, func
+from sqlalchemy.exc import OperationalError
+
+def seed(stock):
+    from app import db
+    from app.category_stats import record_product_change, snapshot
+    from app.models import Category, Product
+    category = Category(name='bench-inventory')
+    db.session.add(category)
+    db.session.flush()
+    product = Product(name='hot product', description='', price=1, image='', category_id=category.id, quantity=stock)
+    db.session.add(product)
+    db.session.flush()
+    record_product_change(after=snapshot(product))
+    db.session.commit()
+    return category.id, product.id
+
+def cleanup(category_id, product_id):
+    from app import db
+    from app.category_stats import record_product_change, snapshot
+    from app.models import Cart, CartItem, Category, Customer, Order, OrderItem, Product, Reservation, SalesRollup, StockShard
+    customer_ids = [row[0] for row in db.session.query(Customer.id).filter(Customer.name == 'bench-inventory')]
+    cart_ids = db.session.query(Cart.id).filter(Cart.customer_id.in_(customer_ids))
+    db.session.execute(delete(Reservation).where(Reservation.cart_id.in_(cart_ids)))
+    db.session.execute(delete(CartItem).where(CartItem.cart_id.in_(cart_ids)))
+    db.session.execute(delete(Cart).where(Cart.customer_id.in_(customer_ids)))
+    db.session.execute(delete(OrderItem).where(OrderItem.product_id == product_id))
+    db.session.execute(delete(Order).where(Order.customer_id.in_(customer_ids)))
+    db.session.execute(delete(Customer).where(Customer.id.in_(customer_ids)))
+    db.session.execute(delete(SalesRollup).where(SalesRollup.category_id == category_id))
+    db.session.execute(delete(Reservation).where(Reservation.product_id == product_id))
+    db.session.execute(delete(StockShard).where(StockShard.product_id == product_id))
+    product = db.session.get(Product, product_id)
+    record_product_change(before=snapshot(product))
+    db.session.delete(product)
+    db.session.delete(db.session.get(Category, category_id))
+    db.session.commit()
+
+def worker(product_id, deadline, counts, index):
+    from app import flask_app, db
+    from app.inventory import commit_reservation, reserve
+    done = failed = 0
+    with flask_app.app_context():
+        while time.perf_counter() < deadline:
+            try:
+                reservation = reserve(product_id, 1)
+                if reservation is None:
+                    db.session.rollback()
+                    failed += 1
+                    continue
+                commit_reservation(reservation.id)
+                db.session.commit()
+                done += 1
+            except OperationalError:
+                db.session.rollback()
+                failed += 1
+    counts[index] = (done, failed)
+
+#one cart per iteration: create it, add the product, maybe reserve a unit for it, check out.
+#Stops at the deadline or once checkouts keep answering 409 (sold out).
+
+def checkout_worker(product_id, customer_id, headers, deadline, counts, index):
+    from app import flask_app
+    client = flask_app.test_client()
+    rng = random.Random(index)
+    done = sold_out = errors = 0
+    while time.perf_counter() < deadline and sold_out < 20:
+        quantity = rng.randint(1, 3)
+        cart = client.post('/cart', json={'customer_id': customer_id}, headers=headers)
+        if cart.status_code != 200:
+            errors += 1
+            continue
+        cart_id = cart.get_json()['id']
+        client.post('/cart-items', json={'cart_id': cart_id, 'product_id': product_id, 'quantity': quantity},
+                    headers=headers)
+        if rng.random() < 0.5:
+            client.post('/reservations', json={'product_id': product_id, 'quantity': 1, 'cart_id': cart_id},
+                        headers=headers)
+        response = client.post('/cart/checkout?id=%d' % cart_id, headers=headers)
+        if response.status_code == 201:
+            done += 1
+        elif response.status_code == 409:
+            sold_out += 1
+        else:
+            errors += 1
+    counts[index] = (done, sold_out, errors)
+
+def run(target, threads, seconds, *args):
+    counts = [None] * threads
+    began = time.perf_counter()
+    deadline = began + seconds
+    pool = [threading.Thread(target=target, args=args + (deadline, counts, index)) for index in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - began
+    return [sum(count[field] for count in counts) / (elapsed if field == 0 else 1)
+            for field in range(len(counts[0]))]
+
+#units sold + units left + units still held by pending reservations must equal the stock
+#the product started with
+
+def stock_balance(product_id, stock):
+    from app import db
+    from app.inventory import available_stock
+    from app.models import OrderItem, Reservation
+    sold = db.session.query(func.coalesce(func.sum(OrderItem.quantity), 0))\
+        .filter(OrderItem.product_id == product_id).scalar()
+    held = db.session.query(func.coalesce(func.sum(Reservation.quantity), 0))\
+        .filter(Reservation.product_id == product_id, Reservation.status == 'pending').scalar()
+    left = available_stock([product_id])[product_id]
+    return int(sold), int(left), int(held), int(sold) + int(left) + int(held) == stock and left >= 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--stock', type=int, default=10000000)
+    parser.add_argument('--checkout-stock', type=int, default=500, help='starting stock of the checkout run')
+    parser.add_argument('--database-url', help='database to run against (default: a temporary SQLite file)')
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ['ECOMMERCE_DATABASE_URL'] = args.database_url
+    else:
+        path = os.path.join(tempfile.mkdtemp(prefix='ecommerce-bench-'), 'bench.db')
+        os.environ['ECOMMERCE_DATABASE_URL'] = 'sqlite:///' + path
+
+    from app import flask_app, db
+    from app.inventory import shard_product
+    from app.models import Customer
+    from benchmarks.run import auth_headers
+
+    balanced = True
+    headers = auth_headers(flask_app.config['SECRET_KEY'])
+    with flask_app.app_context():
+        if not args.database_url:
+            db.create_all()
+        for shards in (0, args.shards):
+            label = 'shards=%d' % shards if shards else 'unsharded'
+            category_id, product_id = seed(args.stock)
+            try:
+                if shards:
+                    shard_product(product_id, shards)
+                    db.session.commit()
+                throughput, failed = run(worker, args.threads, args.seconds, product_id)
+                print('%-12s threads=%-3d reservations/s=%-10.1f failed=%d' % (label, args.threads, throughput, failed))
+            finally:
+                cleanup(category_id, product_id)
+
+            category_id, product_id = seed(args.checkout_stock)
+            customer = Customer(name='bench-inventory', email='', phone='', address='', city='', state='', zip='',
+                                country='')
+            db.session.add(customer)
+            db.session.commit()
+            try:
+                if shards:
+                    shard_product(product_id, shards)
+                    db.session.commit()
+                throughput, sold_out, errors = run(checkout_worker, args.threads, args.seconds, product_id,
+                                                   customer.id, headers)
+                db.session.expire_all()
+                sold, left, held, ok = stock_balance(product_id, args.checkout_stock)
+                balanced = balanced and ok
+                print('%-12s threads=%-3d checkouts/s=%-13.1f sold out=%d errors=%d  sold=%d left=%d reserved=%d %s'
+                      % (label, args.threads, throughput, sold_out, errors, sold, left, held,
+                         'balanced' if ok else 'STOCK DOES NOT BALANCE'))
+            finally:
+                cleanup(category_id, product_id)
+    return 0 if balanced else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""Overhead of the per-request metrics (Flask hooks plus SQLAlchemy engine events).
+
+Seeds a temporary SQLite database, then replays the read scenarios through the test client
+in alternating rounds with instrumentation on and off. Each on/off pair gives one overhead
+figure (relative change of the median latency); the median over all pairs is reported, which
+keeps one noisy round from deciding the result. Exits non-zero if the overhead exceeds --budget. From the ecommerce directory:
+
+    python -m benchmarks.bench_metrics --rounds 10 --requests 20 --budget 0.05
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+def measure(client, scenarios, sizes, requests, headers, random_seed):
+    latencies = []
+    for name, method, build in scenarios:
+        rng = random.Random(random_seed)
+        for _ in range(requests):
+            path, body = build(rng, sizes)
+            began = time.perf_counter()
+            response = client.open(path, method=method, json=body, headers=headers)
+            response.get_data()
+            response.close()
+            latencies.append(time.perf_counter() - began)
+    return latencies
+
+def main():
+    from benchmarks.profiles import PROFILES
+    parser = argparse.ArgumentParser(description='Measure the overhead of request metrics.')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='small')
+    parser.add_argument('--rounds', type=int, default=10, help='on/off round pairs')
+    parser.add_argument('--requests', type=int, default=20, help='requests per route per round')
+    parser.add_argument('--routes', help='only run routes whose name contains this text')
+    parser.add_argument('--budget', type=float, default=0.05, help='allowed relative increase of the median latency')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='ecommerce-bench-'), 'bench.db')
+    os.environ['ECOMMERCE_DATABASE_URL'] = 'sqlite:///' + path
+    os.environ['ECOMMERCE_METRICS_ENABLED'] = 'true'
+
+    from app import flask_app, db
+    from app.request_metrics import request_metrics
+    from benchmarks.run import auth_headers
+    from benchmarks.scenarios import READ_SCENARIOS
+    from benchmarks.seed import seed
+
+    sizes = PROFILES[args.profile]
+    scenarios = [scenario for scenario in READ_SCENARIOS if not args.routes or args.routes in scenario[0]]
+    with flask_app.app_context():
+        db.create_all()
+        seed(sizes, args.seed)
+        engine = db.engine
+
+    client = flask_app.test_client()
+    headers = auth_headers(flask_app.config['SECRET_KEY'])
+    measure(client, scenarios, sizes, 2, headers, args.seed)
+
+    overheads = []
+    for round in range(args.rounds):
+        medians = {}
+        #alternate which mode goes first so drift (caches, CPU frequency) hits both equally
+        for enabled in ((True, False) if round % 2 == 0 else (False, True)):
+            if enabled != request_metrics.enabled:
+                request_metrics.enabled = enabled
+                if enabled:
+                    request_metrics.instrument(engine)
+                else:
+                    request_metrics.remove(engine)
+            medians[enabled] = statistics.median(measure(client, scenarios, sizes, args.requests, headers, args.seed))
+        overheads.append((medians[True] - medians[False]) / medians[False])
+        print('round %2d: off %.3fms  on %.3fms  %+.1f%%' % (
+            round + 1, medians[False] * 1000, medians[True] * 1000, overheads[-1] * 100))
+
+    overhead = statistics.median(overheads)
+    print('median overhead: %+.1f%% (budget %.0f%%)' % (overhead * 100, args.budget * 100))
+    return 1 if overhead > args.budget else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""List serialization: ORM objects + to_dict + jsonify vs projected tuples + app.encoding.
+
+Seeds a temporary SQLite database, then builds one page of each list route both ways inside
+a request context: the previous path (hydrate the model, call to_dict per row, encode with
+Flask's encoder) and the projected one (select the columns as tuples, build the dicts from
+them, encode with orjson when installed), plus the projected path narrowed with ?fields=.
+Reports the median time per page and checks that both paths produce the same JSON. From the
+ecommerce directory:
+
+    python -m benchmarks.bench_serialization --profile small --limit 1000 --repeat 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+#route -> (model name, ?fields= for the narrowed run)
+ROUTES = {
+    '/products': ('Product', 'name,price'),
+    '/customers': ('Customer', 'name,email'),
+    '/orders': ('Order', 'order_date,total_amount'),
+    '/order-items': ('OrderItem', 'product_id,quantity'),
+}
+
+def timed(build, repeat):
+    times = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        body = build()
+        times.append(time.perf_counter() - began)
+    return statistics.median(times), body
+
+def main():
+    from benchmarks.profiles import PROFILES
+    parser = argparse.ArgumentParser(description='Compare the ORM and projected serialization of list pages.')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='small')
+    parser.add_argument('--limit', type=int, default=1000, help='rows per page')
+    parser.add_argument('--repeat', type=int, default=20, help='pages built per path')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='ecommerce-bench-'), 'bench.db')
+    os.environ['ECOMMERCE_DATABASE_URL'] = 'sqlite:///' + path
+
+    from flask import json
+    from app import flask_app, db, models
+    from app.encoding import dumps, orjson
+    from app.order_totals import backfill_order_totals
+    from app.projection import projected
+    from benchmarks.seed import seed
+
+    with flask_app.app_context():
+        db.create_all()
+        seed(PROFILES[args.profile], args.seed)
+        backfill_order_totals(db.session.connection())
+        db.session.commit()
+
+    print('encoder: %s, %d rows per page' % ('orjson' if orjson is not None else 'flask json', args.limit))
+    failed = False
+    for route, (name, fields) in ROUTES.items():
+        model = getattr(models, name)
+
+        def orm():
+            rows = model.query.order_by(model.id).limit(args.limit)
+            return json.dumps([row.to_dict() for row in rows]).encode()
+
+        def projection():
+            query, serialize = projected(model.query, model)
+            return dumps([serialize(row) for row in query.order_by(model.id).limit(args.limit)])
+
+        with flask_app.test_request_context(route):
+            orm_time, orm_body = timed(orm, args.repeat)
+            projected_time, projected_body = timed(projection, args.repeat)
+            db.session.remove()
+        with flask_app.test_request_context(route + '?fields=' + fields):
+            narrow_time, _ = timed(projection, args.repeat)
+            db.session.remove()
+
+        same = json.loads(orm_body) == json.loads(projected_body)
+        failed = failed or not same
+        print('%-13s orm %8.2fms  projected %8.2fms (%4.1fx)  fields=%-25s %8.2fms (%4.1fx)%s' % (
+            route, orm_time * 1000, projected_time * 1000, orm_time / projected_time, fields,
+            narrow_time * 1000, orm_time / narrow_time, '' if same else '  OUTPUT DIFFERS'))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
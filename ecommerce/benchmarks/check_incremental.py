@@ -0,0 +1,129 @@
+"""Checks incrementally maintained aggregates against a rebuild.
+
+Seeds a temporary SQLite database, then sends a random sequence of order item creates (single
+and bulk), updates (quantity, product, order), deletes and order date moves through the test
+client. The writes are spread over a few orders so items often enter or leave an order's
+category. Afterwards the sales_rollups rows the writes left are compared with what
+rebuild_sales_rollups computes from the order items, and the recommendation co-occurrence
+counts and top-k lists (built before the writes, then adjusted by them) with a fresh build.
+Exits non-zero on any difference. From the ecommerce directory:
+
+    python -m benchmarks.check_incremental --profile small --operations 500
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+
+def item_body(rng, orders, sizes):
+    return {'order_id': rng.randint(1, orders), 'product_id': rng.randint(1, sizes['products']),
+            'quantity': rng.randint(1, 5)}
+
+#sends one random write; items holds the ids of the order items that exist
+
+def write(client, headers, rng, orders, sizes, items):
+    operation = rng.choice(('create', 'create', 'bulk', 'update', 'update', 'delete', 'move'))
+    if operation == 'create':
+        response = client.post('/order-items', json=item_body(rng, orders, sizes), headers=headers)
+        items.append(response.get_json()['id'])
+    elif operation == 'bulk':
+        response = client.post('/order-items/bulk', json=[item_body(rng, orders, sizes) for _ in range(rng.randint(2, 20))],
+                               headers=headers)
+        items.extend(result['id'] for result in response.get_json()['results'])
+    elif operation == 'update':
+        change = rng.choice(({'quantity': rng.randint(1, 5)}, {'product_id': rng.randint(1, sizes['products'])},
+                             {'order_id': rng.randint(1, orders)}))
+        response = client.put('/order-items/item?item=%d' % rng.choice(items), json=change, headers=headers)
+    elif operation == 'delete':
+        id = items.pop(rng.randrange(len(items)))
+        response = client.delete('/order-items/item?item=%d' % id, headers=headers)
+    else:
+        date = datetime.datetime(2023, 1, 1) + datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+        response = client.put('/orders/order?order=%d' % rng.randint(1, orders), json={'order_date': date.isoformat(' ')},
+                              headers=headers)
+    if response.status_code >= 400:
+        raise RuntimeError('%s failed with %d: %s' % (operation, response.status_code, response.get_data(as_text=True)))
+
+#(day, category) -> (orders, units, revenue in cents); rows that went back to zero are left out
+
+def sales_rollups(connection):
+    from sqlalchemy import select
+    from app.models import SalesRollup
+    rows = connection.execute(select(SalesRollup.bucket_date, SalesRollup.category_id, SalesRollup.order_count,
+                                     SalesRollup.units, SalesRollup.revenue))
+    return {(str(day), category_id): (orders, units, round(float(revenue) * 100))
+            for day, category_id, orders, units, revenue in rows if orders or units or revenue}
+
+def check_sales_rollups():
+    from app import db
+    from app.sales_rollups import rebuild_sales_rollups
+    connection = db.session.connection()
+    stored = sales_rollups(connection)
+    rebuild_sales_rollups(connection)
+    rebuilt = sales_rollups(connection)
+    db.session.rollback()
+    return ['sales_rollups %s: incremental %s, rebuilt %s' % (key, stored.get(key), rebuilt.get(key))
+            for key in sorted(set(stored) | set(rebuilt)) if stored.get(key) != rebuilt.get(key)]
+
+#product -> non-zero co-occurrence counts and product -> top-k, without empty rows
+
+def recommendation_state(recommendations):
+    counts = {product_id: {other: count for other, count in row.items() if count}
+              for product_id, row in recommendations.counts.items()}
+    return ({product_id: row for product_id, row in counts.items() if row},
+            {product_id: top for product_id, top in recommendations.top.items() if top})
+
+def check_recommendations(incremental):
+    from app.recommendations import Recommendations
+    rebuilt = Recommendations()
+    rebuilt.build()
+    differences = []
+    for name, stored, fresh in zip(('counts', 'top'), recommendation_state(incremental), recommendation_state(rebuilt)):
+        differences.extend('recommendations %s of product %s: incremental %s, rebuilt %s' % (
+            name, product_id, stored.get(product_id), fresh.get(product_id))
+            for product_id in sorted(set(stored) | set(fresh)) if stored.get(product_id) != fresh.get(product_id))
+    return differences
+
+def main():
+    from benchmarks.profiles import PROFILES
+    parser = argparse.ArgumentParser(description='Compare incrementally maintained aggregates with a rebuild.')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='small')
+    parser.add_argument('--operations', type=int, default=500, help='writes sent before comparing')
+    parser.add_argument('--orders', type=int, default=20, help='orders the writes are spread over')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='ecommerce-check-'), 'check.db')
+    os.environ['ECOMMERCE_DATABASE_URL'] = 'sqlite:///' + path
+
+    from app import flask_app, db
+    from app.models import OrderItem
+    from app.recommendations import recommendations
+    from benchmarks.run import auth_headers
+    from benchmarks.seed import seed
+
+    sizes = PROFILES[args.profile]
+    orders = min(args.orders, sizes['orders'])
+    with flask_app.app_context():
+        db.create_all()
+        seed(sizes, args.seed)
+        items = [id for id, in db.session.query(OrderItem.id)]
+        recommendations.build()
+
+    client = flask_app.test_client()
+    headers = auth_headers(flask_app.config['SECRET_KEY'])
+    rng = random.Random(args.seed)
+    for _ in range(args.operations):
+        write(client, headers, rng, orders, sizes, items)
+
+    with flask_app.app_context():
+        differences = check_sales_rollups() + check_recommendations(recommendations)
+    for difference in differences:
+        print(difference)
+    print('%d writes, %d differences' % (args.operations, len(differences)))
+    return 1 if differences else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,7 @@
+"""Data set sizes for the benchmark database."""
+
+PROFILES = {
+    'small': {'categories': 20, 'products': 2000, 'customers': 500, 'orders': 2000, 'items_per_order': 3, 'carts': 200},
+    'medium': {'categories': 200, 'products': 50000, 'customers': 10000, 'orders': 50000, 'items_per_order': 4, 'carts': 2000},
+    'large': {'categories': 1000, 'products': 500000, 'customers': 100000, 'orders': 500000, 'items_per_order': 4, 'carts': 20000},
+}
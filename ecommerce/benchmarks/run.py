@@ -0,0 +1,233 @@
+"""Seeds a benchmark database and measures every API route.
+
+From the ecommerce directory:
+
+    python -m benchmarks.run --profile small                     # test client, temporary SQLite file
+    python -m benchmarks.run --profile small --save              # also write benchmarks/baselines/small.json
+    python -m benchmarks.run --profile small --writes --heavy --requests 100 --save   # how small.json is made
+    python -m benchmarks.run --profile small --compare           # diff against the saved baseline
+    python -m benchmarks.run --url http://127.0.0.1:5000 --concurrency 16   # HTTP load against a running server
+
+Per route it reports p50/p95/p99 latency, throughput and SQL statements per request.
+By default the database is a fresh SQLite file; pass --database-url to use something
+else (it is seeded, so never point it at a database you care about).
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def summarize(latencies, elapsed, statements=None, errors=0):
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0
+    }
+    if statements is not None:
+        result['statements_per_request'] = round(statements / len(latencies), 2)
+    return result
+
+#counts statements sent to the database through SQLAlchemy engine events
+
+class StatementCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+def auth_headers(secret_key, user='bench'):
+    import jwt
+    token = jwt.encode({'user': user, 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1)}, secret_key)
+    return {'Authorization': 'Bearer %s' % token}
+
+#a builder returns (path, body), or (path, body, headers) when the scenario needs its own headers
+
+def request_of(built, headers):
+    path, body = built[:2]
+    return path, body, built[2] if len(built) > 2 else headers
+
+def run_client(scenarios, sizes, requests, random_seed, warmup=5):
+    from app import flask_app, db
+    client = flask_app.test_client()
+    headers = auth_headers(flask_app.config['SECRET_KEY'])
+    with flask_app.app_context():
+        counter = StatementCounter(db.engine)
+    results = {}
+    for name, method, build in scenarios:
+        rng = random.Random(random_seed)
+        for _ in range(warmup):
+            path, body, request_headers = request_of(build(rng, sizes), headers)
+            client.open(path, method=method, json=body, headers=request_headers).close()
+        latencies = []
+        errors = 0
+        counter.count = 0
+        start = time.perf_counter()
+        for _ in range(requests):
+            path, body, request_headers = request_of(build(rng, sizes), headers)
+            began = time.perf_counter()
+            response = client.open(path, method=method, json=body, headers=request_headers)
+            response.get_data()
+            response.close()
+            latencies.append(time.perf_counter() - began)
+            if response.status_code >= 400:
+                errors += 1
+        results[name] = summarize(latencies, time.perf_counter() - start, counter.count, errors)
+        print_row(name, results[name])
+    return results
+
+def run_http(url, scenarios, sizes, requests, concurrency, random_seed, secret_key):
+    headers = auth_headers(secret_key)
+    results = {}
+    for name, method, build in scenarios:
+        if method != 'GET':
+            continue
+        latencies = []
+        errors = [0]
+        lock = threading.Lock()
+        rng = random.Random(random_seed)
+        paths = [request_of(build(rng, sizes), headers) for _ in range(requests)]
+
+        def worker(paths):
+            for path, _, request_headers in paths:
+                began = time.perf_counter()
+                try:
+                    request = urllib.request.Request(url.rstrip('/') + path.replace(' ', '%20'), headers=request_headers)
+                    with urllib.request.urlopen(request) as response:
+                        response.read()
+                except (urllib.error.URLError, OSError):
+                    with lock:
+                        errors[0] += 1
+                with lock:
+                    latencies.append(time.perf_counter() - began)
+
+        threads = [threading.Thread(target=worker, args=(paths[index::concurrency],)) for index in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results[name] = summarize(latencies, time.perf_counter() - start, errors=errors[0])
+        print_row(name, results[name])
+    return results
+
+def print_row(name, result):
+    print('%-50s p50=%8.2fms p95=%8.2fms p99=%8.2fms %9.1f req/s %s%s' % (
+        name, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['throughput_rps'],
+        'sql=%.1f ' % result['statements_per_request'] if 'statements_per_request' in result else '',
+        'errors=%d' % result['errors'] if result['errors'] else ''))
+
+#prints routes whose p95 or statement count moved by more than the threshold
+
+def compare(results, baseline, threshold):
+    regressions = 0
+    for name, result in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None:
+            print('%-50s new route' % name)
+            continue
+        notes = []
+        for key in ('p95_ms', 'statements_per_request'):
+            if key in result and key in old and old[key]:
+                change = (result[key] - old[key]) / old[key]
+                if abs(change) > threshold:
+                    notes.append('%s %+.0f%%' % (key, change * 100))
+                    regressions += change > 0
+        if notes:
+            print('%-50s %s' % (name, ', '.join(notes)))
+    return regressions
+
+def main():
+    from benchmarks.profiles import PROFILES
+    parser = argparse.ArgumentParser(description='Benchmark every ecommerce API route.')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='small')
+    for key in PROFILES['small']:
+        parser.add_argument('--' + key.replace('_', '-'), type=int, dest=key, help='override the profile size')
+    parser.add_argument('--requests', type=int, default=50, help='requests per route')
+    parser.add_argument('--database-url', help='database to seed (default: a temporary SQLite file)')
+    parser.add_argument('--no-seed', action='store_true', help='use the database as it is')
+    parser.add_argument('--writes', action='store_true', help='include write routes')
+    parser.add_argument('--heavy', action='store_true', help='include full-table report routes')
+    parser.add_argument('--routes', help='only run routes whose name contains this text')
+    parser.add_argument('--url', help='load-test a running server over HTTP instead of the test client')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed requests per route before measuring')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--secret-key', help='SECRET_KEY of the server given by --url, to sign the bench token')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', nargs='?', const='', help='save results as a baseline (default: baselines/<profile>.json)')
+    parser.add_argument('--compare', nargs='?', const='', help='compare with a baseline (default: baselines/<profile>.json)')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative change reported by --compare')
+    args = parser.parse_args()
+
+    sizes = dict(PROFILES[args.profile])
+    sizes.update({key: getattr(args, key) for key in sizes if getattr(args, key) is not None})
+
+    if not args.url:
+        if args.database_url:
+            os.environ['ECOMMERCE_DATABASE_URL'] = args.database_url
+        else:
+            path = os.path.join(tempfile.mkdtemp(prefix='ecommerce-bench-'), 'bench.db')
+            os.environ['ECOMMERCE_DATABASE_URL'] = 'sqlite:///' + path
+
+    from benchmarks.scenarios import HEAVY_SCENARIOS, READ_SCENARIOS, WRITE_SCENARIOS
+    scenarios = list(READ_SCENARIOS)
+    if args.heavy:
+        scenarios += HEAVY_SCENARIOS
+    if args.writes:
+        scenarios += WRITE_SCENARIOS
+    if args.routes:
+        scenarios = [scenario for scenario in scenarios if args.routes in scenario[0]]
+
+    if args.url:
+        from app.config import DEFAULTS
+        results = run_http(args.url, scenarios, sizes, args.requests, args.concurrency, args.seed,
+                           args.secret_key or DEFAULTS['SECRET_KEY'])
+    else:
+        from app import flask_app, db
+        from benchmarks.seed import seed
+        with flask_app.app_context():
+            if not args.no_seed:
+                db.create_all()
+                started = time.perf_counter()
+                seed(sizes, args.seed)
+                print('seeded %s in %.1fs' % (', '.join('%s=%d' % item for item in sorted(sizes.items())),
+                                              time.perf_counter() - started))
+        results = run_client(scenarios, sizes, args.requests, args.seed, args.warmup)
+
+    report = {'profile': args.profile, 'sizes': sizes, 'requests': args.requests,
+              'mode': 'http' if args.url else 'client', 'routes': results}
+    baseline_path = lambda value: value or os.path.join(BASELINE_DIR, '%s%s.json' % (args.profile, '-http' if args.url else ''))
+
+    if args.compare is not None:
+        with open(baseline_path(args.compare)) as f:
+            regressions = compare(results, json.load(f)['routes'], args.threshold)
+        print('%d regressions over %.0f%%' % (regressions, args.threshold * 100))
+    if args.save is not None:
+        path = baseline_path(args.save)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('baseline written to %s' % path)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""Request scenarios covering every route of the API, for the Flask test client and the HTTP load generator."""
+import base64
+import datetime
+import itertools
+
+#each scenario is (name, method, builder); builder(rng, sizes) returns (path, json body or None),
+#or (path, body, headers) when the request needs other headers than the bench token
+
+def pick(rng, count):
+    return rng.randint(1, count)
+
+#The DELETE, checkout and reservation scenarios act on rows whose ids are known from a fresh
+#seed: the rows an earlier write scenario created (POST /categories makes categories
+#sizes['categories'] + 1, + 2, ... and DELETE /categories/category removes them in that order),
+#or seeded rows no other scenario reads afterwards. They need a freshly seeded database and the
+#write scenarios run in the order listed; a --routes filter that skips the creating scenario
+#turns them into 404s.
+
+def created(table):
+    ids = itertools.count(1)
+    return lambda s: s[table] + next(ids)
+
+def oldest():
+    ids = itertools.count(1)
+    return lambda s: next(ids)
+
+def newest(table):
+    ids = itertools.count(0)
+    return lambda s: s[table] - next(ids)
+
+new_category, new_product, new_customer, new_order, new_cart = (
+    created(table) for table in ('categories', 'products', 'customers', 'orders', 'carts'))
+first_order_item, first_cart_item, first_reservation = oldest(), oldest(), oldest()
+last_cart = newest('carts')
+
+#commit and release share one sequence: commit takes the reservations made by the first
+#POST /reservations scenario, release those made by the second
+reservation = oldest()
+
+LOGIN_HEADERS = {'Authorization': 'Basic %s' % base64.b64encode(b'bench:tal').decode()}
+sessions = itertools.count(1)
+
+#/logout revokes the token it is sent, so each request signs one of its own
+
+def session_headers():
+    from app import flask_app
+    from benchmarks.run import auth_headers
+    return auth_headers(flask_app.config['SECRET_KEY'], 'bench session %d' % next(sessions))
+
+def search(rng):
+    from benchmarks.seed import WORDS
+    return '/products/search?q=%s&limit=20' % rng.choice(WORDS), None
+
+def order_item(rng, s):
+    return {'order_id': pick(rng, s['orders']), 'product_id': pick(rng, s['products']), 'quantity': 1}
+
+def cart_item(rng, s):
+    return {'cart_id': pick(rng, s['carts']), 'product_id': pick(rng, s['products']), 'quantity': 1}
+
+def price_band(rng):
+    low = rng.randint(1, 490)
+    return '/products/cost?min_cost=%d&max_cost=%d' % (low, low + 5), None
+
+READ_SCENARIOS = [
+    ('GET /categories', 'GET', lambda rng, s: ('/categories', None)),
+    ('GET /categories/category', 'GET', lambda rng, s: ('/categories/category?category=%d' % pick(rng, s['categories']), None)),
+    ('GET /products', 'GET', lambda rng, s: ('/products', None)),
+    ('GET /products?after', 'GET', lambda rng, s: ('/products?limit=100&after=%d' % pick(rng, s['products']), None)),
+    ('GET /products/product', 'GET', lambda rng, s: ('/products/product?product=%d' % pick(rng, s['products']), None)),
+    ('GET /customers', 'GET', lambda rng, s: ('/customers', None)),
+    ('GET /customers/customer', 'GET', lambda rng, s: ('/customers/customer?customer=%d' % pick(rng, s['customers']), None)),
+    ('GET /orders', 'GET', lambda rng, s: ('/orders', None)),
+    ('GET /orders/order', 'GET', lambda rng, s: ('/orders/order?order=%d' % pick(rng, s['orders']), None)),
+    ('GET /order-items', 'GET', lambda rng, s: ('/order-items', None)),
+    ('GET /order-items/item', 'GET', lambda rng, s: ('/order-items/item?item=%d' % pick(rng, s['orders']), None)),
+    ('GET /cart', 'GET', lambda rng, s: ('/cart', None)),
+    ('GET /cart/id', 'GET', lambda rng, s: ('/cart/id?id=%d' % pick(rng, s['carts']), None)),
+    ('GET /cart-items', 'GET', lambda rng, s: ('/cart-items', None)),
+    ('GET /cart-items/item', 'GET', lambda rng, s: ('/cart-items/item?item=%d' % pick(rng, s['carts']), None)),
+    ('GET /categories-with-products', 'GET', lambda rng, s: ('/categories-with-products?limit=20&products_limit=20', None)),
+    ('GET /avg_price_by_category', 'GET', lambda rng, s: ('/avg_price_by_category', None)),
+    ('GET /products_quantity_per_category', 'GET', lambda rng, s: ('/products_quantity_per_category', None)),
+    ('GET /products_quantity_per_category/category', 'GET',
+     lambda rng, s: ('/products_quantity_per_category/category?category=category %d' % pick(rng, s['categories']), None)),
+    ('GET /orders-per-customers', 'GET', lambda rng, s: ('/orders-per-customers', None)),
+    ('GET /orders-per-customers/customer', 'GET',
+     lambda rng, s: ('/orders-per-customers/customer?id=%d' % pick(rng, s['customers']), None)),
+    ('GET /order-data-of-customers/customer', 'GET',
+     lambda rng, s: ('/order-data-of-customers/customer?id=%d' % pick(rng, s['customers']), None)),
+    ('GET /num-of-orders-all-customers', 'GET', lambda rng, s: ('/num-of-orders-all-customers', None)),
+    ('GET /num-of-orders-customers/customer', 'GET',
+     lambda rng, s: ('/num-of-orders-customers/customer?id=%d' % pick(rng, s['customers']), None)),
+    ('GET /total-price-of-order/order', 'GET', lambda rng, s: ('/total-price-of-order/order?id=%d' % pick(rng, s['orders']), None)),
+    ('GET /total-count-of-order/order', 'GET', lambda rng, s: ('/total-count-of-order/order?id=%d' % pick(rng, s['orders']), None)),
+    ('GET /total-products-per-order/product', 'GET',
+     lambda rng, s: ('/total-products-per-order/product?id=%d' % pick(rng, s['products']), None)),
+    ('GET /products/cost', 'GET', lambda rng, s: price_band(rng)),
+    ('GET /products/stock', 'GET', lambda rng, s: ('/products/stock?stock=999000', None)),
+    ('GET /products?fields', 'GET', lambda rng, s: ('/products?fields=name,price', None)),
+    ('GET /products/search', 'GET', lambda rng, s: search(rng)),
+    ('GET /products/best-sellers', 'GET', lambda rng, s: ('/products/best-sellers', None)),
+    ('GET /products/best-sellers?scope=category', 'GET',
+     lambda rng, s: ('/products/best-sellers?scope=category&category=%d' % pick(rng, s['categories']), None)),
+    ('GET /products/best-sellers?scope=24h', 'GET', lambda rng, s: ('/products/best-sellers?scope=24h', None)),
+    ('GET /products/recommendations', 'GET',
+     lambda rng, s: ('/products/recommendations?product=%d' % pick(rng, s['products']), None)),
+    ('GET /orders?include', 'GET', lambda rng, s: ('/orders?include=items,customer&limit=100', None)),
+    ('GET /orders/order?include', 'GET', lambda rng, s: ('/orders/order?order=%d&include=items' % pick(rng, s['orders']), None)),
+    ('GET /cart?include', 'GET', lambda rng, s: ('/cart?include=items&limit=100', None)),
+    ('GET /cart/id?include', 'GET', lambda rng, s: ('/cart/id?id=%d&include=items,customer' % pick(rng, s['carts']), None)),
+    ('GET /cart/summary', 'GET', lambda rng, s: ('/cart/summary?id=%d' % pick(rng, s['carts']), None)),
+    ('GET /reports/sales', 'GET', lambda rng, s: ('/reports/sales?from=2023-01-01&to=2023-03-31', None)),
+    ('GET /reports/sales?granularity=month', 'GET',
+     lambda rng, s: ('/reports/sales?granularity=month&category=%d' % pick(rng, s['categories']), None)),
+    ('GET /login', 'GET', lambda rng, s: ('/login', None, LOGIN_HEADERS)),
+    ('GET /metrics', 'GET', lambda rng, s: ('/metrics', None)),
+    ('GET /metrics/pool', 'GET', lambda rng, s: ('/metrics/pool', None)),
+    ('GET /cache/stats', 'GET', lambda rng, s: ('/cache/stats', None)),
+    ('GET /admin/slow-queries', 'GET', lambda rng, s: ('/admin/slow-queries?limit=20', None)),
+]
+
+#full-table reports, only run when --heavy is given since they scale with the whole data set
+
+HEAVY_SCENARIOS = [
+    ('GET /order-data-of-customers', 'GET', lambda rng, s: ('/order-data-of-customers', None)),
+    ('GET /total-price-of-order', 'GET', lambda rng, s: ('/total-price-of-order', None)),
+    ('GET /total-count-of-order', 'GET', lambda rng, s: ('/total-count-of-order', None)),
+    ('GET /export/order-items', 'GET', lambda rng, s: ('/export/order-items', None)),
+    ('GET /export/order-items?format=ndjson', 'GET', lambda rng, s: ('/export/order-items?format=ndjson', None)),
+]
+
+WRITE_SCENARIOS = [
+    ('POST /categories', 'POST', lambda rng, s: ('/categories', {'name': 'bench category'})),
+    ('PUT /categories/category', 'PUT', lambda rng, s: ('/categories/category?category=%d' % pick(rng, s['categories']),
+                                                        {'name': 'category renamed'})),
+    ('POST /products', 'POST', lambda rng, s: ('/products', {
+        'name': 'bench product', 'description': 'bench', 'price': 9.99, 'image': 'bench.png',
+        'category_id': pick(rng, s['categories']), 'quantity': 10})),
+    ('PUT /products/product', 'PUT', lambda rng, s: ('/products/product?product=%d' % pick(rng, s['products']),
+                                                     {'price': round(rng.uniform(1, 500), 2)})),
+    ('POST /customers', 'POST', lambda rng, s: ('/customers', {
+        'name': 'bench', 'email': 'bench@example.com', 'phone': '555', 'address': 'a', 'city': 'c', 'state': 's',
+        'zip': '1', 'country': 'c'})),
+    ('PUT /customers/customer', 'PUT', lambda rng, s: ('/customers/customer?customer=%d' % pick(rng, s['customers']),
+                                                       {'city': 'Elsewhere'})),
+    ('POST /orders', 'POST', lambda rng, s: ('/orders', {
+        'customer_id': pick(rng, s['customers']), 'order_date': datetime.datetime(2024, 1, 1).isoformat(' ')})),
+    ('PUT /orders/order', 'PUT', lambda rng, s: ('/orders/order?order=%d' % pick(rng, s['orders']), {
+        'order_date': datetime.datetime(2023, rng.randint(1, 12), rng.randint(1, 28)).isoformat(' ')})),
+    ('POST /order-items', 'POST', lambda rng, s: ('/order-items', order_item(rng, s))),
+    ('PUT /order-items/item', 'PUT', lambda rng, s: ('/order-items/item?item=%d' % pick(rng, s['orders']), {'quantity': 2})),
+    ('POST /order-items/bulk', 'POST', lambda rng, s: ('/order-items/bulk', [order_item(rng, s) for _ in range(100)])),
+    ('POST /cart', 'POST', lambda rng, s: ('/cart', {'customer_id': pick(rng, s['customers'])})),
+    ('PUT /cart/id', 'PUT', lambda rng, s: ('/cart/id?id=%d' % pick(rng, s['carts']), {'customer_id': pick(rng, s['customers'])})),
+    ('POST /cart-items', 'POST', lambda rng, s: ('/cart-items', cart_item(rng, s))),
+    ('PUT /cart-items/item', 'PUT', lambda rng, s: ('/cart-items/item?item=%d' % pick(rng, s['carts']), {'quantity': 2})),
+    ('POST /cart-items/bulk', 'POST', lambda rng, s: ('/cart-items/bulk', [cart_item(rng, s) for _ in range(100)])),
+    ('POST /products/bulk', 'POST', lambda rng, s: ('/products/bulk', [{
+        'name': 'bulk product', 'description': 'bench', 'price': 1.5, 'image': 'bulk.png',
+        'category_id': pick(rng, s['categories']), 'quantity': 5} for _ in range(100)])),
+    ('POST /products/bulk?upsert', 'POST', lambda rng, s: ('/products/bulk?upsert=true', [{
+        'id': pick(rng, s['products']), 'price': round(rng.uniform(1, 500), 2)} for _ in range(100)])),
+    ('POST /reservations', 'POST', lambda rng, s: ('/reservations', {'product_id': pick(rng, s['products']), 'quantity': 1})),
+    ('GET /reservations/reservation', 'GET', lambda rng, s: ('/reservations/reservation?id=%d' % first_reservation(s), None)),
+    ('POST /reservations/commit', 'POST', lambda rng, s: ('/reservations/commit?id=%d' % reservation(s), None)),
+    ('POST /reservations (to release)', 'POST',
+     lambda rng, s: ('/reservations', {'product_id': pick(rng, s['products']), 'quantity': 1})),
+    ('POST /reservations/release', 'POST', lambda rng, s: ('/reservations/release?id=%d' % reservation(s), None)),
+    ('POST /cart/checkout', 'POST', lambda rng, s: ('/cart/checkout?id=%d' % last_cart(s), None)),
+    ('POST /logout', 'POST', lambda rng, s: ('/logout', None, session_headers())),
+    ('DELETE /cart-items/item', 'DELETE', lambda rng, s: ('/cart-items/item?item=%d' % first_cart_item(s), None)),
+    ('DELETE /cart/id', 'DELETE', lambda rng, s: ('/cart/id?id=%d' % new_cart(s), None)),
+    ('DELETE /order-items/item', 'DELETE', lambda rng, s: ('/order-items/item?item=%d' % first_order_item(s), None)),
+    ('DELETE /orders/order', 'DELETE', lambda rng, s: ('/orders/order?order=%d' % new_order(s), None)),
+    ('DELETE /customers/customer', 'DELETE', lambda rng, s: ('/customers/customer', {'customer': new_customer(s)})),
+    ('DELETE /products/product', 'DELETE', lambda rng, s: ('/products/product?product=%d' % new_product(s), None)),
+    ('DELETE /categories/category', 'DELETE', lambda rng, s: ('/categories/category?category=%d' % new_category(s), None)),
+]
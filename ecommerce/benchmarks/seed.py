@@ -0,0 +1,69 @@
+"""Deterministic data generator for the benchmark database."""
+import datetime
+import random
+
+from sqlalchemy import insert
+
+from app import db
+from app.category_stats import rebuild_category_stats
+from app.order_totals import backfill_order_totals
+from app.sales_rollups import rebuild_sales_rollups
+from app.models import Cart, CartItem, Category, Customer, Order, OrderItem, Product
+
+CHUNK_SIZE = 5000
+WORDS = ('red', 'blue', 'green', 'cotton', 'leather', 'running', 'winter', 'summer', 'classic', 'slim',
+         'shoe', 'shirt', 'jacket', 'lamp', 'chair', 'table', 'phone', 'cable', 'watch', 'bag')
+
+def insert_chunks(model, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            db.session.execute(insert(model), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(insert(model), chunk)
+
+def words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+def seed(sizes, random_seed=42):
+    rng = random.Random(random_seed)
+    start = datetime.datetime(2023, 1, 1)
+
+    insert_chunks(Category, ({'id': id, 'name': 'category %d' % id} for id in range(1, sizes['categories'] + 1)))
+    insert_chunks(Product, ({
+        'id': id,
+        'name': words(rng, 3),
+        'description': words(rng, 12),
+        'price': round(rng.uniform(1, 500), 2),
+        'image': 'product-%d.png' % id,
+        'category_id': rng.randint(1, sizes['categories']),
+        'quantity': rng.randint(0, 1000000)
+    } for id in range(1, sizes['products'] + 1)))
+    insert_chunks(Customer, ({
+        'id': id, 'name': 'customer %d' % id, 'email': 'customer%d@example.com' % id, 'phone': '555-%07d' % id,
+        'address': '%d Main St' % id, 'city': 'City', 'state': 'State', 'zip': '%05d' % (id % 100000),
+        'country': 'Country'
+    } for id in range(1, sizes['customers'] + 1)))
+    insert_chunks(Order, ({
+        'id': id,
+        'customer_id': rng.randint(1, sizes['customers']),
+        'order_date': start + datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+    } for id in range(1, sizes['orders'] + 1)))
+    insert_chunks(OrderItem, ({
+        'order_id': order_id,
+        'product_id': rng.randint(1, sizes['products']),
+        'quantity': rng.randint(1, 5)
+    } for order_id in range(1, sizes['orders'] + 1) for _ in range(rng.randint(1, sizes['items_per_order']))))
+    insert_chunks(Cart, ({'id': id, 'customer_id': rng.randint(1, sizes['customers'])}
+                         for id in range(1, sizes['carts'] + 1)))
+    insert_chunks(CartItem, ({
+        'cart_id': cart_id,
+        'product_id': rng.randint(1, sizes['products']),
+        'quantity': rng.randint(1, 3)
+    } for cart_id in range(1, sizes['carts'] + 1) for _ in range(rng.randint(1, 4))))
+    backfill_order_totals(db.session.connection())
+    rebuild_sales_rollups(db.session.connection())
+    rebuild_category_stats(db.session.connection())
+    db.session.commit()